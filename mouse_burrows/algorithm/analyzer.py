@@ -21,7 +21,7 @@ from ..algorithm import FirstPass, SecondPass, ThirdPass, FourthPass
 from .data_handler import DataHandler
 from .objects import mouse
 from utils.data_structures.misc import OmniContainer
-from utils.math import contiguous_int_regions_iter, is_equidistant
+from utils.math import is_equidistant
 from external.kids_cache import cache
 from video.analysis import curves
 
@@ -70,9 +70,11 @@ class Analyzer(DataHandler):
             self.time_scale = self.time_scale_mag
             self.length_scale = self.length_scale_mag
 
+        self.area_scale = self.length_scale**2
         self.speed_scale = self.length_scale / self.time_scale
         self.burrow_pass = self.data['parameters/analysis/burrow_pass']
         self._cache = {}
+        self._mouse_track_cache = {}
         
         
     @cache
@@ -132,6 +134,13 @@ class Analyzer(DataHandler):
         ground0 = ground_profile.get_ground_profile(frames[0])
         ground1 = ground_profile.get_ground_profile(frames[1])
         
+        return self._get_ground_differences(ground0, ground1)
+    
+    
+    def _get_ground_differences(self, ground0, ground1):
+        """ returns shape polygons or polygon collections of ground area that
+        was removed and added, respectively, between the ground profiles
+        `ground0` and `ground1` """
         # get the ground polygons
         left = min(ground0.points[0, 0], ground1.points[0, 0])
         right = max(ground0.points[-1, 0], ground1.points[-1, 0])
@@ -149,8 +158,8 @@ class Analyzer(DataHandler):
     def get_ground_change_areas(self, frames=None):
         """ returns the area of the ground that was removed and added """
         area_removed, area_accrued = self.get_ground_changes(frames)
-        return (area_removed.area * self.length_scale**2,
-                area_accrued.area * self.length_scale**2)
+        return (area_removed.area * self.area_scale,
+                area_accrued.area * self.area_scale)
         
         
     #===========================================================================
@@ -243,15 +252,16 @@ class Analyzer(DataHandler):
         
         results = []
         for burrow_track in burrow_tracks:
-            # read raw data
-            times = np.asarray(burrow_track.times)
-            lenghts = [burrow.length for burrow in burrow_track.burrows]
-            
             # get the indices in the analysis range
+            times = np.asarray(burrow_track.times)
             idx = self.get_frame_roi(times)
             
+            # read the lengths, which are stored with the burrows, only for
+            # the burrows in the analysis range
+            lengths = [burrow.length for burrow in burrow_track.burrows[idx]]
+            
             # append the data to the result
-            data = np.c_[times[idx]*self.time_scale, lenghts[idx]]
+            data = np.c_[times[idx]*self.time_scale, lengths]
             results.append(data)
                   
         return results
@@ -426,11 +436,17 @@ class Analyzer(DataHandler):
     #===========================================================================
 
 
+    @cache
+    def _get_mouse_track(self):
+        """ returns the mouse track, which is only looked up once """
+        return self.data['pass2/mouse_trajectory']
+
+
     def get_mouse_track_data(self, attribute='pos', night_only=True):
         """ returns information about the tracked mouse position or velocity """
         try:
             # read raw data for the frames that we are interested in 
-            mouse_track = self.data['pass2/mouse_trajectory']
+            mouse_track = self._get_mouse_track()
             
         except KeyError:
             raise RuntimeError('The mouse trajectory has to be determined '
@@ -438,14 +454,21 @@ class Analyzer(DataHandler):
         
         else:            
             # extract the right attribute from the mouse track
-            if attribute == 'trajectory_smoothed':
-                sigma = self.data['parameters/tracking/position_smoothing_window']
-                data = mouse_track.trajectory_smoothed(sigma)
-                
-            elif attribute == 'velocity':
-                sigma = self.data['parameters/tracking/position_smoothing_window']
-                mouse_track.calculate_velocities(sigma=sigma)
-                data = mouse_track.velocity
+            if attribute in {'trajectory_smoothed', 'velocity'}:
+                # these attributes need to be calculated, so we cache them
+                sigma = self.params['tracking/position_smoothing_window']
+                try:
+                    data = self._mouse_track_cache[attribute, sigma]
+                except KeyError:
+                    if attribute == 'trajectory_smoothed':
+                        data = mouse_track.trajectory_smoothed(sigma)
+                    else:
+                        mouse_track.calculate_velocities(sigma=sigma)
+                        # copy the data, since the mouse track owns it
+                        data = mouse_track.velocity.copy()
+                    # the cached data must not be modified by the caller
+                    data.flags.writeable = False
+                    self._mouse_track_cache[attribute, sigma] = data
                 
             else:
                 data = getattr(mouse_track, attribute)
@@ -482,7 +505,7 @@ class Analyzer(DataHandler):
         are set to `invalid`, if `invalid` is not None """
         velocity = self.get_mouse_track_data('velocity')
         if invalid is not None:
-            velocity[np.isnan(velocity)] = invalid
+            velocity = np.where(np.isnan(velocity), invalid, velocity)
         return velocity * self.length_scale / self.time_scale
 
 
@@ -532,9 +555,8 @@ class Analyzer(DataHandler):
             states = self.mouse_states_default
             
         # convert the mouse states into integers according to the defined states
-        lut = mouse.state_converter.get_state_lookup_table(states)
-        state_cat = np.array([-1 if lut[state] is None else lut[state]
-                              for state in mouse_state])
+        lut = mouse.state_converter.get_state_lookup_array(states)
+        state_cat = lut[mouse_state]
             
         if ret_states:
             return states, state_cat
@@ -552,14 +574,19 @@ class Analyzer(DataHandler):
         """
         states, state_cat = self.get_mouse_state_vector(states, ret_states=True)
             
-        # get durations
-        durations = collections.defaultdict(list)
-        for state, start, end in contiguous_int_regions_iter(state_cat):
-            durations[state].append(end - start)
+        # get the length of all runs of constant state
+        if len(state_cat) > 0:
+            bounds = np.r_[0, np.flatnonzero(np.diff(state_cat) != 0) + 1,
+                           len(state_cat)]
+            lengths = np.diff(bounds)
+            run_states = state_cat[bounds[:-1]]
+        else:
+            lengths = run_states = np.array([], np.int)
             
-        # convert to numpy arrays and add units
-        durations = {states[key]: np.array(value) * self.time_scale
-                     for key, value in durations.iteritems()}
+        # group the durations by state and add units
+        durations = {states[state]: lengths[run_states == state]
+                                    * self.time_scale
+                     for state in np.unique(run_states) if state >= 0}
             
         if ret_states:
             return durations, states
@@ -583,9 +610,8 @@ class Analyzer(DataHandler):
             states = self.mouse_states_default
             
         # cluster mouse states according to the defined states
-        lut = mouse.state_converter.get_state_lookup_table(states)
-        state_cat = [-1 if lut[state] is None else lut[state]
-                     for state in mouse_state]
+        lut = mouse.state_converter.get_state_lookup_array(states)
+        state_cat = lut[mouse_state]
             
         if ret_states:
             return state_cat, states
@@ -610,22 +636,33 @@ class Analyzer(DataHandler):
                                          self.units.Quantity):
             duration_threshold /= self.units.second
             
-        # get transitions
-        transitions = collections.defaultdict(list)
-        last_trans = 0
-        for k in np.nonzero(np.diff(state_cat) != 0)[0]:
-            if state_cat[k] < 0 or state_cat[k + 1] < 0:
-                # this transition involves uncategorized states
-                continue
-            duration = (k - last_trans)
-            if duration > duration_threshold:
-                trans = (states[state_cat[k]], states[state_cat[k + 1]])
-                transitions[trans].append(duration)
-            last_trans = k
-            
-        # convert to numpy arrays and add units
-        transitions = {key: np.array(value) * self.time_scale
-                       for key, value in transitions.iteritems()}
+        # get transitions, ignoring those involving uncategorized states
+        trans_idx = np.flatnonzero(np.diff(state_cat) != 0)
+        state_from = state_cat[trans_idx]
+        state_to = state_cat[trans_idx + 1]
+        valid = (state_from >= 0) & (state_to >= 0)
+        trans_idx = trans_idx[valid]
+        state_from, state_to = state_from[valid], state_to[valid]
+        
+        # the duration is measured from the previous transition
+        durations = np.diff(np.r_[0, trans_idx])
+        valid = (durations > duration_threshold)
+        durations = durations[valid]
+        
+        # group the durations by the states involved in the transition, keeping
+        # the temporal order of the durations within each group
+        # the states are converted to a larger type to prevent overflows
+        codes = (state_from[valid].astype(np.int) * len(states)
+                 + state_to[valid])
+        order = np.argsort(codes, kind='mergesort')
+        codes, durations = codes[order], durations[order]
+        codes, starts = np.unique(codes, return_index=True)
+        
+        # convert to dictionary and add units
+        transitions = {}
+        for code, values in zip(codes, np.split(durations, starts[1:])):
+            trans = (states[code // len(states)], states[code % len(states)])
+            transitions[trans] = values * self.time_scale
             
         if ret_states:
             return transitions, states
@@ -641,17 +678,20 @@ class Analyzer(DataHandler):
         transitions, states = self.get_mouse_state_transitions(ret_states=True,
                                                                **kwargs)
             
-        # build the matrix
-        rates = np.empty((len(states), len(states)))
-        rates.fill(np.nan)
-        counts = np.zeros_like(rates)
+        # determine the matrix indices of all transitions
         states = sorted(states)
         lut = {s: k for k, s in enumerate(states)}
-        for trans, lengths in transitions.iteritems():
-            # calculate the transition rate            
-            rate = 1/np.mean(lengths)
-            rates[lut[trans[0]], lut[trans[1]]] = rate
-            counts[lut[trans[0]], lut[trans[1]]] = len(lengths)
+        keys = transitions.keys()
+        rows = np.fromiter((lut[trans[0]] for trans in keys), np.int,
+                           len(keys))
+        cols = np.fromiter((lut[trans[1]] for trans in keys), np.int,
+                           len(keys))
+            
+        # build the matrix
+        rates = np.full((len(states), len(states)), np.nan)
+        counts = np.zeros_like(rates)
+        rates[rows, cols] = [1/np.mean(transitions[trans]) for trans in keys]
+        counts[rows, cols] = [len(transitions[trans]) for trans in keys]
             
         if ret_states:
             return rates, counts, states
@@ -673,7 +713,7 @@ class Analyzer(DataHandler):
 
             # get statistics            
             rate = 1/np.mean(lengths)
-            nodes[u] += sum(lengths)
+            nodes[u] += lengths.sum()
 
             # add the edge
             graph.add_edge(u, v, rate=rate, count=len(lengths))
@@ -696,6 +736,7 @@ class Analyzer(DataHandler):
         import matplotlib.pyplot as plt
         from matplotlib.path import Path
         from matplotlib import patches, cm, colors, colorbar
+        from matplotlib.collections import PatchCollection
         
         # get the transition graph
         graph = self.get_mouse_transition_graph(**kwargs)
@@ -737,6 +778,7 @@ class Analyzer(DataHandler):
         max_count = max(edge[2]['count'] for edge in edges)
         curve_bend = 0.08 #< determines the distance of the two edges between nodes
         colormap = cm.autumn
+        edge_patches, arrow_patches = [], []
         for u, v, data in edges:
             # calculate edge properties
             width = log_scale(data['count'],
@@ -754,9 +796,8 @@ class Analyzer(DataHandler):
             # plot Bezier curve
             codes = [Path.MOVETO, Path.CURVE3, Path.CURVE3]
             path = Path((p1, pm, p2), codes)
-            patch = patches.PathPatch(path, facecolor='none',
-                                      edgecolor=color, lw=width)
-            ax.add_patch(patch)
+            edge_patches.append(patches.PathPatch(path, facecolor='none',
+                                                  edgecolor=color, lw=width))
             
             # add arrow head
             if width > 1:
@@ -766,9 +807,15 @@ class Analyzer(DataHandler):
                 dp /= np.linalg.norm(dp)
                 pc_diff = 0.1*dp
                 pc2 = p2 - 0.6*dp
-                ax.arrow(pc2[0], pc2[1], pc_diff[0], pc_diff[1],
-                         head_width=0.1,
-                         edgecolor='none', facecolor=color)
+                arrow_patches.append(
+                    patches.FancyArrow(pc2[0], pc2[1], pc_diff[0], pc_diff[1],
+                                       head_width=0.1, edgecolor='none',
+                                       facecolor=color)
+                )
+                
+        # add all edges and arrow heads as a single artist
+        ax.add_collection(PatchCollection(edge_patches + arrow_patches,
+                                          match_original=True))
                 
         # add a colorbar explaining the color scheme
         cax = ax.figure.add_axes([0.87, 0.1, 0.03, 0.8])
@@ -932,6 +979,15 @@ class Analyzer(DataHandler):
         frame_ivals = [(a, b + 1) for a, b in itertools.izip(frame_range,
                                                              frame_range[1:])]
         frame_slices = [slice(a, b + 1) for a, b in frame_ivals]
+        slice_starts = np.array([f.start for f in frame_slices], np.int)
+        slice_stops = np.array([f.stop for f in frame_slices], np.int)
+        
+        def sum_slices(values):
+            """ returns the sum of the `values` in each time slice, which is
+            determined from the cumulative sum of all values """
+            values_cum = np.r_[0, np.cumsum(values)]
+            return (values_cum[slice_stops.clip(0, len(values))]
+                    - values_cum[slice_starts.clip(0, len(values))])
 
         # length of the periods
         period_durations = (np.array([(b - a + 1) for a, b in frame_ivals]) 
@@ -946,16 +1002,25 @@ class Analyzer(DataHandler):
 
         # get the area changes of the ground line
         if 'ground_removed' in keys or 'ground_accrued' in keys:
-            area_removed, area_accrued = [], []
-            for f in frame_slices:
-                poly_rem, poly_acc = self.get_ground_changes((f.start, f.stop))
-                area_removed.append(poly_rem.area)
-                area_accrued.append(poly_acc.area)
+            ground_profile = self.data['pass2/ground_profile']
+            area_removed = np.zeros(len(frame_slices))
+            area_accrued = np.zeros(len(frame_slices))
+            for k, f in enumerate(frame_slices):
+                ground0 = ground_profile.get_ground_profile(f.start)
+                ground1 = ground_profile.get_ground_profile(f.stop)
+                if ground0 is ground1:
+                    # the same ground profile is used for both frames, which
+                    # is returned from the cache of the profile list
+                    continue
+                poly_rem, poly_acc = self._get_ground_differences(ground0,
+                                                                  ground1)
+                area_removed[k] = poly_rem.area
+                area_accrued[k] = poly_acc.area
 
             if 'ground_removed' in keys:
-                result['ground_removed'] = area_removed * self.length_scale**2
+                result['ground_removed'] = area_removed * self.area_scale
             if 'ground_accrued' in keys:
-                result['ground_accrued'] = area_accrued * self.length_scale**2
+                result['ground_accrued'] = area_accrued * self.area_scale
 
         # get durations of the mouse being in different states        
         for key, pattern in (('time_spent_aboveground', '.(A|H|V)..'),
@@ -969,56 +1034,76 @@ class Analyzer(DataHandler):
             # alternatively, the computation might be requested directly
             if c or key in keys:
                 states = self.get_mouse_state_vector([pattern])
-                duration = [np.count_nonzero(states[t_slice] == 0)
-                            for t_slice in frame_slices]
+                duration = sum_slices(states == 0)
                 result[key] = duration * self.time_scale
                 key_fraction = key.replace('time_', 'fraction_')
                 result[key_fraction] = np.array(result[key]) / period_durations
 
         # get velocity statistics
-        speed_statistics = {
-            'mouse_speed_mean': lambda x: np.nan_to_num(np.array(x)).mean(),
-            'mouse_speed_mean_valid': lambda x: np.nanmean(x),
-            'mouse_speed_max': lambda x: np.nanmax(x)
-        }
+        speed_statistics = ('mouse_speed_mean', 'mouse_speed_mean_valid',
+                            'mouse_speed_max')
+        if any(key + suffix in keys
+               for key in speed_statistics
+               for suffix in ('', '_aboveground', '_underground')):
+            velocities = self.get_mouse_velocities()
+            speed = np.hypot(velocities[:, 0], velocities[:, 1])
+            speed_valid = ~np.isnan(speed)
+            
         # iterate through all regions that we want to distinguish
         for suffix, pattern in [('', '....'),
                                 ('_aboveground', '.(A|H|V)..'),
                                 ('_underground', '.(B|D)..')]:
             
             # iterate through all velocity statistics that we want to distinguish
-            if any(key + suffix in keys for key in speed_statistics.keys()):
-                # get velocities
-                velocities = self.get_mouse_velocities()
-                speed = np.hypot(velocities[:, 0], velocities[:, 1])
+            if any(key + suffix in keys for key in speed_statistics):
                 # get the states that match the region pattern
-                states = self.get_mouse_state_vector([pattern])
+                in_state = (self.get_mouse_state_vector([pattern]) == 0)
+                valid = in_state & speed_valid
+                
+                # count the frames and sum the speed in each time slice
+                count = sum_slices(in_state)
+                count_valid = sum_slices(valid)
+                speed_sum = sum_slices(np.where(valid, speed, 0))
                 
-                for key, stat_func in speed_statistics.iteritems():
-                    # get the states
-                    res = [] 
-                    for t_slice in frame_slices:
-                        # restrict values to the right time slice
-                        speed_sliced = speed[t_slice]
-                        states_sliced = states[t_slice]
-                        # find the speed where the mouse is in the right state
-                        speed_in_state = speed_sliced[states_sliced == 0]
-                        if len(speed_in_state) == 0:
-                            res.append(np.nan)
-                        else: 
-                            # calculate the respective statistics
-                            res.append(stat_func(speed_in_state))
-#                     res = [stat_func(speed[t_slice]) for t_slice in frame_slices]
-                    result[key + suffix] = np.array(res) * self.speed_scale
+                # get the maximal speed in each time slice by reducing over the
+                # intervals between alternating start and stop indices. An
+                # additional element makes the last stop a valid index.
+                if len(frame_slices) > 0:
+                    speed_max = np.r_[np.where(valid, speed, -np.inf), -np.inf]
+                    indices = np.c_[slice_starts, slice_stops]
+                    indices = indices.clip(0, len(speed)).ravel()
+                    speed_max = np.maximum.reduceat(speed_max, indices)[::2]
+                else:
+                    speed_max = np.array([])
+                
+                with np.errstate(divide='ignore', invalid='ignore'):
+                    res = {'mouse_speed_mean': speed_sum / count,
+                           'mouse_speed_mean_valid': speed_sum / count_valid,
+                           'mouse_speed_max': speed_max}
+                res['mouse_speed_max'][count_valid == 0] = np.nan
+                
+                for key in speed_statistics:
+                    # periods in which the mouse was never in the right state
+                    res[key][count == 0] = np.nan
+                    result[key + suffix] = res[key] * self.speed_scale
         
         # get distance statistics
         if 'mouse_distance_covered' in keys:
             trajectory = self.get_mouse_trajectory()
-            dist = []
-            for t_slice in frame_slices:
-                trajectory_part = trajectory[t_slice]
-                valid = np.isfinite(trajectory_part[:, 0])
-                dist.append(curves.curve_length(trajectory_part[valid]))
+            # determine the cumulative length of the curve connecting all
+            # valid points of the trajectory
+            valid_idx = np.flatnonzero(np.isfinite(trajectory[:, 0]))
+            points = trajectory[valid_idx]
+            steps = np.hypot(*np.diff(points, axis=0).T)
+            length = np.r_[0, np.cumsum(steps)]
+            
+            # the distance covered in a slice is the length of the curve
+            # between the first and the last valid point in the slice
+            idx_start = np.searchsorted(valid_idx, slice_starts)
+            idx_stop = np.searchsorted(valid_idx, slice_stops)
+            dist = np.zeros(len(frame_slices))
+            i = (idx_stop - idx_start >= 2)  #< slices with at least two points
+            dist[i] = length[idx_stop[i] - 1] - length[idx_start[i]]
             result['mouse_distance_covered'] = dist * self.length_scale
 
         if 'mouse_trail_longest' in keys:
@@ -1048,7 +1133,7 @@ class Analyzer(DataHandler):
             
             if 'burrow_area_excavated' in keys or 'mouse_digging_rate' in keys:
                 try:
-                    area_excavated = stats[:, 0] * self.length_scale**2
+                    area_excavated = stats[:, 0] * self.area_scale
                 except IndexError:
                     area_excavated = []
                 result['burrow_area_excavated'] = area_excavated
@@ -1066,8 +1151,8 @@ class Analyzer(DataHandler):
             time_min = self.params['mouse/digging_rate_time_min']
             if self.use_units:
                 time_min *= self.time_scale
-                unit_rate = self.length_scale**2 / self.time_scale
-                area_min = 0 * self.length_scale**2
+                unit_rate = self.area_scale / self.time_scale
+                area_min = 0 * self.area_scale
             else:
                 unit_rate = 1
                 area_min = 0
@@ -1123,7 +1208,7 @@ class Analyzer(DataHandler):
         # predug statistics
         if 'predug_area' in keys:
             predug = self.get_burrow_predug()
-            result['predug_area'] = predug.area * self.length_scale**2
+            result['predug_area'] = predug.area * self.area_scale
         
         # check if the burrows need to be analyzed
         if any(key in keys for key in ('burrow_area_total',
@@ -1163,7 +1248,7 @@ class Analyzer(DataHandler):
             if 'burrow_length_total' in keys:
                 result['burrow_length_total'] = length_total * self.length_scale
             if 'burrow_area_total' in keys:
-                result['burrow_area_total'] = area_total * self.length_scale**2
+                result['burrow_area_total'] = area_total * self.area_scale
 
         # check if the main burrow needs to be analyzed
         if any(key in keys for key in ('burrow_main_initiated',
@@ -8,12 +8,19 @@ contains classes that manage data input and output
 
 from __future__ import division
 
+import cPickle as pickle
 import datetime
 import logging
 import os
 import subprocess
+import tempfile
 
 import yaml
+try:
+    # use the fast C implementation of the YAML parser if available
+    from yaml import CLoader as YAMLLoader
+except ImportError:
+    from yaml import Loader as YAMLLoader
 try:
     import dateutil
 except ImportError:
@@ -42,6 +49,58 @@ except ImportError:
 
 
 
+def read_yaml_file(filename, use_cache=False):
+    """ reads the content of a YAML file. If `use_cache` is True, the parsed
+    content is also stored in a pickle file next to the YAML file, which is
+    read instead of the YAML file as long as the modification time and the
+    size of the YAML file did not change """
+    cache_file = filename + '.pkl'
+
+    if use_cache:
+        stat = os.stat(filename)
+        signature = (stat.st_mtime, stat.st_size)
+        
+        try:
+            with open(cache_file, 'rb') as fp:
+                cached_signature, content = pickle.load(fp)
+        except Exception:
+            # the cache file does not exist or cannot be read
+            pass
+        else:
+            if cached_signature == signature:
+                return content
+            logging.debug('The cache file `%s` is outdated', cache_file)
+
+    # parse the YAML file, using a large buffer to reduce the number of reads
+    with open(filename, 'rb', 1 << 20) as infile:
+        content = yaml.load(infile, Loader=YAMLLoader)
+
+    if use_cache:
+        # write the cache to a temporary file first and move it in place
+        # afterwards, such that other processes never read incomplete data
+        cache_dir, cache_name = os.path.split(cache_file)
+        try:
+            fd, tmp_file = tempfile.mkstemp(prefix=cache_name + '.',
+                                            dir=cache_dir or '.')
+        except (IOError, OSError):
+            logging.debug('Could not write the cache file `%s`', cache_file)
+        else:
+            try:
+                with os.fdopen(fd, 'wb') as fp:
+                    pickle.dump((signature, content), fp,
+                                protocol=pickle.HIGHEST_PROTOCOL)
+                os.rename(tmp_file, cache_file)
+            except Exception:
+                logging.debug('Could not write the cache file `%s`', cache_file)
+                try:
+                    os.remove(tmp_file)
+                except OSError:
+                    pass
+
+    return content
+
+
+
 class DataHandler(object):
     """ class that handles the data and parameters of mouse tracking """
     logging_mode = 'append'
@@ -67,8 +126,11 @@ class DataHandler(object):
 
     
     def __init__(self, name='', parameters=None, initialize_parameters=True,
-                 read_data=False):
+                 read_data=False, use_yaml_cache=False):
+        """ initializes the data handler. If `use_yaml_cache` is True, the
+        parsed result file is cached in a pickle file next to it """
         self.name = name
+        self.use_yaml_cache = use_yaml_cache
         self.logger = logging.getLogger('mouse_burrows')
 
         # initialize the data handled by this class
@@ -430,8 +492,7 @@ class DataHandler(object):
         filename = self.get_filename('results.yaml', 'results')
         self.logger.info('Read YAML data from %s', filename)
         
-        with open(filename, 'r') as infile:
-            yaml_content = yaml.load(infile)
+        yaml_content = read_yaml_file(filename, use_cache=self.use_yaml_cache)
             
         if yaml_content: 
             self.data.from_dict(yaml_content)
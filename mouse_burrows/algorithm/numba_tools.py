@@ -0,0 +1,34 @@
+'''
+Contains helper functions for optionally compiling functions with numba
+'''
+
+from __future__ import division
+
+try:
+    import numba
+except ImportError:
+    numba = None
+    
+# flag indicating whether functions decorated with `jit` are compiled
+NUMBA_AVAILABLE = numba is not None
+
+
+
+def jit(*args, **kwargs):
+    """ decorator that compiles a function with numba in nopython mode if
+    numba is available. The arguments are passed on to `numba.njit`.
+    Otherwise, the pure python function is returned unchanged.
+    """
+    if args and callable(args[0]):
+        # the decorator has been used without arguments
+        return jit()(args[0])
+
+    def decorator(func):
+        """ compiles the function if possible """
+        if numba is None:
+            return func
+        else:
+            return numba.njit(*args, **kwargs)(func)
+
+    return decorator
+
@@ -12,7 +12,6 @@ import copy
 import itertools
 
 import numpy as np
-from scipy import cluster 
 import shapely
 from shapely import geometry
 
@@ -82,6 +81,7 @@ class Burrow(shapes.Polygon):
         super(Burrow, self).__init__(contour)
             
         self.refined = refined
+        self.elongated = False
         self._centerline = None
         self._endpoints = None
 
@@ -172,10 +172,9 @@ class Burrow(shapes.Polygon):
     def get_exit_regions(self, ground_line):
         """ returns parts of the outline that are associated with exits """
         # determine burrow points close to the ground
-        g_line = ground_line.linestring
         dist_max = self.parameters['ground_point_distance']
-        exitpoints = [point for point in self.contour
-                      if g_line.distance(geometry.Point(point)) < dist_max]
+        contour = np.asarray(self.contour, np.double)
+        exitpoints = contour[ground_line.get_distances(contour) < dist_max]
 
         if len(exitpoints) == 0:
             exit_regions = []
@@ -183,10 +182,10 @@ class Burrow(shapes.Polygon):
             exit_regions = [exitpoints]
         else:
             # check whether points are clustered around other points
-            exitpoints = np.array(exitpoints)
-    
             # cluster the points to detect multiple connections 
             # this is important when a burrow has multiple exits to the ground
+            # scipy.cluster is imported here since it is slow to load
+            from scipy import cluster
             dist_max = self.parameters['width']
             data = cluster.hierarchy.fclusterdata(exitpoints, dist_max,
                                                   method='single', 
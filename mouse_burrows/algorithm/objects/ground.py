@@ -40,6 +40,7 @@ class GroundProfile(object):
             self._points = self._points[::-1]
             
         self._cache_methods = {} #< reset the cache of the cached_property
+        self._polygons = {} #< reset the cache of get_polygon
         
         
     def __repr__(self):
@@ -57,6 +58,12 @@ class GroundProfile(object):
         return curves.curve_length(self.points)
     
 
+    @cached_property()
+    def points_int32(self):
+        """ returns the points as an integer array, e.g. for drawing """
+        return self.points.astype(np.int32)
+    
+
     @cached_property()
     def linestring(self):
         """ returns a shapely line string corresponding to the ground """
@@ -94,9 +101,22 @@ class GroundProfile(object):
             
                 
     def get_polygon(self, depth=None, left=None, right=None):
-        """ returns a polygon representing the ground with a given `depth` """
+        """ returns a polygon representing the ground with a given `depth`.
+        The polygons of the most recent calls are cached, since the same
+        profile is often compared to several other profiles """
+        key = (depth, left, right)
+        try:
+            return self._polygons[key]
+        except KeyError:
+            pass
+        
         points = self.get_polygon_points(depth, left, right)
-        return geometry.Polygon(points)
+        polygon = geometry.Polygon(points)
+        
+        if len(self._polygons) >= 4:
+            self._polygons.clear()
+        self._polygons[key] = polygon
+        return polygon
     
                 
     def get_sky_polygon(self, height=50):
@@ -127,6 +147,32 @@ class GroundProfile(object):
                                            copy=False)
     
     
+    @cached_property()
+    def coordinates(self):
+        """ returns the x and y coordinates of the points as separate
+        contiguous arrays """
+        return (np.ascontiguousarray(self._points[:, 0]),
+                np.ascontiguousarray(self._points[:, 1]))
+    
+    
+    @cached_property()
+    def segments(self):
+        """ returns the start points, the direction vectors, and the squared
+        lengths of the line segments between the points of the profile """
+        start = np.ascontiguousarray(self._points[:-1])
+        direction = self._points[1:] - start
+        length2 = (direction**2).sum(axis=1)
+        length2[length2 == 0] = 1 #< avoid division by zero
+        return start, direction, length2
+    
+    
+    def get_closest_point_index(self, point):
+        """ returns the index of the profile point closest to `point` """
+        xs, ys = self.coordinates
+        # compare squared distances to avoid taking square roots
+        return np.argmin((xs - point[0])**2 + (ys - point[1])**2)
+    
+    
     def get_y(self, x, nearest_neighbor=False):
         """ returns the y-value of the profile at a given x-position.
         This function interpolates between points and extrapolates beyond the
@@ -142,12 +188,49 @@ class GroundProfile(object):
         """ calculates the (signed) distance of a point to the ground line. If
         the distance is signed, points above the ground are associated with 
         negative distances """
-        dist = self.linestring.distance(geometry.Point(x, y))
+        dist = self.get_distances([(x, y)])[0]
         if signed and self.above_ground((x, y)):
             dist *= -1
         return dist
 
         
+    def get_projection_point(self, point):
+        """ returns the point on the ground line that is closest to `point`
+        """
+        point = np.asarray(point, np.double)
+        start, direction, length2 = self.segments
+        
+        # project the point onto all segments and pick the closest projection
+        t = np.clip(((point - start)*direction).sum(axis=1)/length2, 0, 1)
+        projections = start + t[:, np.newaxis]*direction
+        idx = np.argmin(((projections - point)**2).sum(axis=1))
+        return projections[idx]
+    
+    
+    def get_distances(self, points, chunk_size=256):
+        """ calculates the distances of all `points` to the ground line. This
+        is a vectorized version of `get_distance` for many points. The points
+        are processed in chunks of `chunk_size`, which bounds the size of the
+        temporary arrays for long ground lines """
+        points = np.asarray(points, np.double).reshape(-1, 2)
+        start, direction, length2 = self.segments
+        
+        dists = np.empty(len(points))
+        for k in xrange(0, len(points), chunk_size):
+            chunk = points[k:k + chunk_size]
+            
+            # project the points onto all segments
+            diff = chunk[:, np.newaxis, :] - start[np.newaxis, :, :]
+            t = np.clip((diff*direction).sum(axis=2)/length2, 0, 1)
+            diff -= t[:, :, np.newaxis]*direction
+            
+            # determine the distance to the closest segment
+            dist2 = (diff**2).sum(axis=2).min(axis=1)
+            dists[k:k + chunk_size] = np.sqrt(dist2)
+            
+        return dists
+
+        
     def above_ground(self, (x, y)):
         """ returns True if the point is above the ground """
         # Note that the y axis points down
@@ -67,6 +67,7 @@ class MouseStateConverter(object):
         self.categories = []
         self.factors = []
         self.max_id = 1
+        self._lookup_arrays = {}
         for data in categories:
             category = MouseStateCategory(**data)
             self.categories.append(category)
@@ -161,6 +162,29 @@ class MouseStateConverter(object):
                 lut[key_int] = None
                 
         return lut
+    
+    
+    def get_state_lookup_array(self, states):
+        """ returns an integer array that maps all possible mouse states onto
+        the index in the list of supplied `states` patterns. Mouse states that
+        do not match any pattern are mapped to -1. The array can thus be used
+        to convert an array of mouse states using fancy indexing. The arrays
+        are cached, since they are requested repeatedly by the analysis. A
+        small integer type is used if possible, which reduces the memory
+        footprint of the converted mouse states. """
+        states = tuple(states)
+        try:
+            lut = self._lookup_arrays[states]
+        except KeyError:
+            dtype = np.int8 if len(states) <= 127 else np.int
+            lut = np.full(self.max_id, -1, dtype)
+            for key, value in self.get_state_lookup_table(states).iteritems():
+                if value is not None:
+                    lut[key] = value
+            # the cached array must not be modified by the caller
+            lut.flags.writeable = False
+            self._lookup_arrays[states] = lut
+        return lut
 
     
 
@@ -20,8 +20,11 @@ top to bottom. The origin is thus in the upper left corner.
 from __future__ import division
 
 import os
+import sys
+import threading
 import time
-from collections import defaultdict, Counter
+from collections import defaultdict, Counter, OrderedDict
+from itertools import compress
 
 import numpy as np
 from scipy import ndimage, spatial
@@ -42,6 +45,7 @@ from .processes.predug_detector import PredugDetector
 from .objects.moving_objects import MovingObject, ObjectTrack, ObjectTrackList
 from .objects.ground import GroundProfile, GroundProfileList
 from .objects.burrow import Burrow, BurrowTrack, BurrowTrackList
+from .video_output import ThreadedVideoComposer
 
 from video import debug  # @UnusedImport
 
@@ -72,6 +76,7 @@ class FirstPass(PassBase):
         self.ground = None             # current model of the ground profile
         self.predug = None             # current predug estimate
         self.tracks = []               # list of plausible mouse models in current _frame
+        self._tracks_moving = np.zeros(0, bool) # which of the tracks are moving
         self.explored_area = None      # region the mouse has explored yet
         self.frame_id = 0              # id of the current _frame
         self.result['objects/moved_first_in_frame'] = None
@@ -161,6 +166,8 @@ class FirstPass(PassBase):
         self.result['ground/profile'] = GroundProfileList()
         if self.params['burrows/enabled_pass1']:
             self.result['burrows/tracks'] = BurrowTrackList()
+        # burrow tracks ordered by the time they were last extended
+        self._active_burrow_tracks = OrderedDict()
 
         self.result['statistics/tracking_moving_threshold'] = Counter()
         
@@ -806,6 +813,7 @@ class FirstPass(PassBase):
         """ ends all current tracks and copies them to the results """
         self.result['objects/tracks'].extend(self.tracks)
         self.tracks = []
+        self._tracks_moving = np.zeros(0, bool)
 
 
     def _handle_object_tracks(self, frame, contours):
@@ -956,6 +964,8 @@ class FirstPass(PassBase):
                         self.result['objects/tracks'].append(obj)
                         
                 self.tracks = new_tracks
+                # all the remaining tracks are moving
+                obj_moving = [True] * len(new_tracks)
                 # remove the tracks that didn't move
                 # this essentially assumes that there is only one mouse
 #                 for k, obj in enumerate(self.tracks):
@@ -965,6 +975,9 @@ class FirstPass(PassBase):
 #                     else:
 #                         self.result['objects/tracks'].append(obj)
 
+            # store which tracks are moving, e.g. for the debug output
+            self._tracks_moving = np.array(obj_moving, bool)
+
             # add new information to explored area
             for track in self.tracks:
                 cv2.drawContours(self.explored_area, contours, 
@@ -1962,13 +1975,18 @@ class FirstPass(PassBase):
                 
                 if track_id is not None:
                     # add the burrow to the current mask
-                    self.result['burrows/tracks'][track_id].append(self.frame_id, burrow)
+                    burrow_track = self.result['burrows/tracks'][track_id]
+                    burrow_track.append(self.frame_id, burrow)
+                    # move the track to the end of the active tracks
+                    self._active_burrow_tracks.pop(track_id, None)
                 else:
                     # otherwise, start a new burrow track
                     burrow_track = BurrowTrack(self.frame_id, burrow)
+                    track_id = len(self.result['burrows/tracks'])
                     self.result['burrows/tracks'].append(burrow_track)
                     self.logger.debug('%d: Found new burrow at %s',
                                       self.frame_id, burrow.polygon.centroid)
+                self._active_burrow_tracks[track_id] = burrow_track
             
         # degrade information about the mouse position inside burrows
         rate = self.params['explored_area/adaptation_rate_burrows']* \
@@ -2037,26 +2055,46 @@ class FirstPass(PassBase):
                     output_period=video_output_period, codec=video_codec,
                     bitrate=video_bitrate
                 )
+                if self.params['use_threads'] and identifier != 'background':
+                    # encode the video in a separate thread. The background
+                    # video is written synchronously, since the frame offset
+                    # is determined from its state
+                    video_writer = ThreadedVideoComposer(video_writer)
                 self.output[identifier + '.video'] = video_writer
         
 
     def debug_process_frame(self, frame):
         """ adds information of the current _frame to the debug output """
+        # label that is shown in all debug videos
+        frame_label = str(self.frame_id)
         
         if 'video' in self.output:
             debug_video = self.output['video']
             
-            # plot the ground profile
-            if self.ground is not None: 
-                debug_video.add_line(self.ground.points, is_closed=False,
-                                     mark_points=True, color='y')
-        
-            # indicate the currently active burrow shapes
-            if self.params['burrows/enabled_pass1']:
-                time_interval = self.params['burrows/adaptation_interval']
-                for burrow_track in self.result['burrows/tracks']:
-                    if burrow_track.track_end > self.frame_id - time_interval:
-                        burrow = burrow_track.last
+            # only draw the overlays if the frame is written to the video
+            if debug_video.output_this_frame:
+                # plot the ground profile and mark every fourth point
+                if self.ground is not None: 
+                    points = self.ground.points_int32
+                    debug_video.add_line(points, is_closed=False, color='y')
+                    debug_video.add_points(points[::4], radius=2, color='y')
+        
+                # indicate the currently active burrow shapes
+                if self.params['burrows/enabled_pass1']:
+                    time_interval = self.params['burrows/adaptation_interval']
+                    active_tracks = self._active_burrow_tracks
+                    # remove tracks that have not been extended recently.
+                    # These are the first items, since the dictionary is
+                    # ordered by the time of the last extension
+                    time_min = self.frame_id - time_interval
+                    while active_tracks:
+                        track_id, burrow_track = next(active_tracks.iteritems())
+                        if burrow_track.track_end > time_min:
+                            break
+                        del active_tracks[track_id]
+                    
+                    for track_id in sorted(active_tracks):
+                        burrow = active_tracks[track_id].last
                         burrow_color = 'red' if burrow.refined else 'orange'
                         debug_video.add_line(burrow.contour, burrow_color,
                                              is_closed=True, mark_points=True)
@@ -2065,39 +2103,51 @@ class FirstPass(PassBase):
                             debug_video.add_line(centerline,
                                                  burrow_color, is_closed=False,
                                                  width=2, mark_points=True)
-                           
-            # indicate the predug if it was found 
-            if self.predug:
-                debug_video.add_line(self.predug.contour, 'white',
-                                     is_closed=True)
-        
-            # indicate the mouse position
-            if len(self.tracks) > 0:
-                for obj in self.tracks:
+                       
+                # indicate the predug if it was found 
+                if self.predug:
+                    debug_video.add_line(self.predug.contour, 'white',
+                                         is_closed=True)
+        
+                # indicate the mouse position
+                if len(self.tracks) > 0:
+                    trail_length = \
+                            self.params['output/video/mouse_trail_length']
+                    radius = self.params['mouse/model_radius']
+                
+                    # group the objects by color, using the moving state
+                    # determined in `find_objects`
                     if self.result['objects/moved_first_in_frame'] is None:
-                        obj_color = 'r'
-                    elif obj.is_moving():
-                        obj_color = 'w'
+                        groups = [('r', self.tracks)]
                     else:
-                        obj_color = 'b'
-                    track = obj.get_track()
-                    trail_length = self.params['output/video/mouse_trail_length']
-                    if len(track) > trail_length:
-                        track = track[-trail_length:]
-                    debug_video.add_line(track, '0.5', is_closed=False)
-                    debug_video.add_circle(obj.last.pos,
-                                           self.params['mouse/model_radius'],
-                                           obj_color, thickness=1)
-                
-            # add additional debug information
-            if debug_video.output_this_frame:
-                debug_video.add_text(str(self.frame_id), (20, 20), anchor='top')   
+                        moving = self._tracks_moving
+                        groups = [('w', compress(self.tracks, moving)),
+                                  ('b', compress(self.tracks, ~moving))]
+
+                    # draw the trails of all objects
+                    for obj in self.tracks:
+                        track = obj.get_track()
+                        if len(track) > trail_length:
+                            track = track[-trail_length:]
+                        debug_video.add_line(track, '0.5', is_closed=False)
+                    
+                    # draw the current positions of all objects
+                    for obj_color, objs in groups:
+                        for obj in objs:
+                            debug_video.add_circle(obj.last.pos, radius,
+                                                   obj_color, thickness=1)
+
+                # add additional debug information
+                debug_video.add_text(frame_label, (20, 20), anchor='top')
                 debug_video.add_text('#obj:%d' % self.debug['object_count'],
                                      (120, 20), anchor='top')
-                debug_video.add_text(self.debug['video.mark.text1'],
-                                     (300, 20), anchor='top')
-                debug_video.add_text(self.debug['video.mark.text2'],
-                                     (300, 50), anchor='top')
+                # the mark texts are usually empty and are then skipped
+                if self.debug['video.mark.text1']:
+                    debug_video.add_text(self.debug['video.mark.text1'],
+                                         (300, 20), anchor='top')
+                if self.debug['video.mark.text2']:
+                    debug_video.add_text(self.debug['video.mark.text2'],
+                                         (300, 50), anchor='top')
             
                 if self.debug.get('video.mark.rects'):
                     for rect in self.debug['video.mark.rects']:
@@ -2127,11 +2177,12 @@ class FirstPass(PassBase):
             video.set_frame(self.background.image.astype(np.uint8))
 
         if 'difference.video' in self.output:
-            diff = frame.astype(int, copy=False) - self.background.image + 128
-            diff = np.clip(diff, 0, 255).astype(np.uint8, copy=False)
+            # calculate frame - background + 128 in a single saturating pass
+            diff = cv2.addWeighted(frame, 1, self.background.image, -1, 128,
+                                   dtype=cv2.CV_8U)
             self.output['difference.video'].set_frame(diff)
-            self.output['difference.video'].add_text(str(self.frame_id),
-                                                     (20, 20), anchor='top')   
+            self.output['difference.video'].add_text(frame_label, (20, 20),
+                                                     anchor='top')   
                 
         if 'explored_area.video' in self.output:
             debug_video = self.output['explored_area.video']
@@ -2141,10 +2192,11 @@ class FirstPass(PassBase):
             
             # plot the ground profile
             if self.ground is not None:
-                debug_video.add_line(self.ground.points, is_closed=False, color='y')
-                debug_video.add_points(self.ground.points, radius=2, color='y')
+                points = self.ground.points_int32
+                debug_video.add_line(points, is_closed=False, color='y')
+                debug_video.add_points(points, radius=2, color='y')
 
-            debug_video.add_text(str(self.frame_id), (20, 20), anchor='top')   
+            debug_video.add_text(frame_label, (20, 20), anchor='top')   
 
 
     def debug_finalize(self):
@@ -2153,15 +2205,38 @@ class FirstPass(PassBase):
         if 'video.show' in self.output:
             self.output['video.show'].close()
         
-        # close the open video streams
+        # close the open video streams in parallel, since flushing the
+        # encoders can take a while
+        threads, errors = [], []
         for video in ('video', 'difference.video', 'background.video',
                       'explored_area.video'):
             if video in self.output:
-                try:
-                    self.output[video].close()
-                except IOError:
-                    self.logger.exception('Error while writing out the debug '
-                                          'video `%s`' % video) 
+                thread = threading.Thread(target=self._debug_close_video,
+                                          args=(video, errors))
+                thread.start()
+                threads.append(thread)
+        
+        # wait for all streams to be closed
+        for thread in threads:
+            thread.join()
+            
+        # raise the first unexpected error in the main thread
+        if errors:
+            exc_type, exc_value, exc_traceback = errors[0]
+            raise exc_type, exc_value, exc_traceback
+            
+            
+    def _debug_close_video(self, video, errors):
+        """ closes the debug video with the given identifier. Unexpected
+        errors are appended to the list `errors`, such that they can be raised
+        in the main thread """
+        try:
+            self.output[video].close()
+        except IOError:
+            self.logger.exception('Error while writing out the debug '
+                                  'video `%s`' % video) 
+        except Exception:
+            errors.append(sys.exc_info())
             
             
     def debug_predug_image(self):
@@ -2175,17 +2250,17 @@ class FirstPass(PassBase):
         img = self.background.image[slice_y, slice_x].astype(np.uint8)
 
         if self.params['predug/debug_with_lines']:
+            offset = (region.x, region.y)
+            
             # get the extracted rectangle
             predug_rect = self.data['pass1/burrows/predug_rect']
-            coords = curves.translate_points(predug_rect, -region.x, -region.y)
-            cv2.polylines(img, [np.array(coords, np.int32)], isClosed=True,
-                          color=[255, 0, 0])
+            coords = (np.asarray(predug_rect) - offset).astype(np.int32)
+            cv2.polylines(img, [coords], isClosed=True, color=[255, 0, 0])
     
             # get the refined predug 
             predug_poly = self.data['pass1/burrows/predug']
-            coords = curves.translate_points(predug_poly, -region.x, -region.y)
-            cv2.polylines(img, [np.array(coords, np.int32)], isClosed=True,
-                          color=[0, 255, 0])
+            coords = (np.asarray(predug_poly) - offset).astype(np.int32)
+            cv2.polylines(img, [coords], isClosed=True, color=[0, 255, 0])
         
         # write file
         filename = self.get_filename('predug.jpg', 'debug')
@@ -14,10 +14,14 @@ import time
 
 import cv2
 import numpy as np
-from scipy import cluster 
+from scipy import sparse, spatial
+from scipy.sparse.csgraph import connected_components
 from shapely import geometry, geos
+from shapely.prepared import prep
+from shapely.strtree import STRtree
 
 from .pass_base import PassBase
+from .numba_tools import jit
 from .objects import mouse
 from .objects.burrow import Burrow, BurrowTrack, BurrowTrackList
 from utils.math import contiguous_int_regions_iter
@@ -25,11 +29,56 @@ from utils.misc import display_progress
 from video.analysis import curves, regions
 from video.filters import FilterCrop
 from video.io import ImageWindow, VideoComposer
+from video.io.parallel import VideoPreprocessor
 
 from video import debug  # @UnusedImport
 
 
 
+@jit(cache=True)
+def _truncate_trail(trail, length, x, y, spacing):
+    """ returns the new length of the mouse trail stored in the first `length`
+    rows of `trail` after removing all points starting with the first one that
+    is closer than `spacing` to the point (x, y) """
+    spacing2 = spacing*spacing
+    for k in range(length):
+        dx = trail[k, 0] - x
+        dy = trail[k, 1] - y
+        if dx*dx + dy*dy < spacing2:
+            return k
+    return length
+
+
+
+@jit(cache=True)
+def _extend_trail(trail, length, x, y, spacing):
+    """ appends the point (x, y) to the mouse trail stored in the first
+    `length` rows of `trail`. A mid point is inserted if the distance to the
+    last point exceeds `spacing`. The array `trail` must be able to hold two
+    additional points. Returns the new length of the mouse trail """
+    dx = x - trail[length - 1, 0]
+    dy = y - trail[length - 1, 1]
+    if dx*dx + dy*dy > spacing*spacing:
+        trail[length, 0] = x - 0.5*dx
+        trail[length, 1] = y - 0.5*dy
+        length += 1
+    trail[length, 0] = x
+    trail[length, 1] = y
+    return length + 1
+
+
+
+def _prepared_intersects(prepared, polygon):
+    """ returns True if the prepared geometry `prepared` intersects `polygon`.
+    Like `Burrow.intersects`, geometric errors are treated as no intersection
+    """
+    try:
+        return prepared.intersects(polygon)
+    except (geos.TopologicalError, geos.PredicateError):
+        return False
+    
+    
+
 class ThirdPass(PassBase):
     """ class containing methods for the third pass, which locates burrows
     based on the mouse movement """
@@ -132,10 +181,12 @@ class ThirdPass(PassBase):
                 
         # initialize data structures
         self.frame_id = -1
-        self.background = self.video[0].astype(np.double)
+        self.background = self.video[0].astype(np.float32)
         self.ground_idx = None  #< index of the ground point where the mouse entered the burrow
+        self._mouse_trail_buffer = np.empty((16, 2)) #< storage of the mouse trail
         self.mouse_trail = None #< line from this point to the mouse (along the burrow)
         self.burrows = []       #< list of current burrows
+        self._burrow_bounds = np.zeros((0, 4)) #< bounding boxes of the burrows
         self._cache = {}
 
         # set up parameters
@@ -143,6 +194,7 @@ class ThirdPass(PassBase):
         moving_threshold /= video_info['fps']
         moving_threshold /= self.data['pass2/pixel_size_cm']
         self.params['mouse/moving_threshold_pixel_frame'] = moving_threshold
+        self._cache['moving_threshold_squared'] = moving_threshold**2
 
         # calculate mouse velocities    
         sigma = self.params['tracking/position_smoothing_window']
@@ -157,27 +209,34 @@ class ThirdPass(PassBase):
         
         # load data from previous passes
         mouse_track = self.data['pass2/mouse_trajectory']
+        mouse_pos_count = len(mouse_track.pos)
         ground_profile = self.data['pass2/ground_profile']
         frame_offset = self.result['video/frames'][0]
         if frame_offset is None:
             frame_offset = 0
+        adaptation_rate = self.params['background/adaptation_rate']
+
+        # create the video iterator, which reads the frames in a separate
+        # thread, such that reading and analyzing the video overlap
+        video_iter = VideoPreprocessor(video, functions={},
+                                       use_threads=self.params['use_threads'])
+        video_iter = display_progress(video_iter)
 
         # iterate over the video and analyze it
-        for self.frame_id, frame in enumerate(display_progress(video),
-                                              frame_offset):
+        for self.frame_id, data in enumerate(video_iter, frame_offset):
+            frame = data['raw']
             
-            # adapt the background to current _frame 
-            adaptation_rate = self.params['background/adaptation_rate']
-            self.background += adaptation_rate*(frame - self.background)
+            # adapt the background to current _frame in place
+            cv2.accumulateWeighted(frame, self.background, adaptation_rate)
             
             # copy _frame to debug video
             if 'video' in self.debug:
                 self.debug['video'].set_frame(frame, copy=False)
             
             # retrieve data for current _frame
-            try:
+            if self.frame_id < mouse_pos_count:
                 self.mouse_pos = mouse_track.pos[self.frame_id, :]
-            except IndexError:
+            else:
                 # Sometimes the mouse trail has not been calculated till the end
                 self.mouse_pos = (np.nan, np.nan)
             self.ground = ground_profile.get_ground_profile(self.frame_id)
@@ -250,46 +309,66 @@ class ThirdPass(PassBase):
     #===========================================================================
 
 
+    @property
+    def mouse_trail(self):
+        """ returns the points of the mouse trail as an array or None if there
+        is no mouse trail. The array is a view on the internal storage and
+        might thus change when the mouse trail is extended. """
+        if self._mouse_trail_length == 0:
+            return None
+        else:
+            return self._mouse_trail_buffer[:self._mouse_trail_length]
+
+    @mouse_trail.setter
+    def mouse_trail(self, points):
+        """ sets the points of the mouse trail """
+        if points is None:
+            self._mouse_trail_length = 0
+        else:
+            points = np.asarray(points, np.double)
+            if len(points) > len(self._mouse_trail_buffer):
+                self._mouse_trail_buffer = np.empty((2*len(points), 2))
+            self._mouse_trail_buffer[:len(points)] = points
+            self._mouse_trail_length = len(points)
+            
+            
+    def _mouse_trail_reserve(self, capacity):
+        """ makes sure that the mouse trail can hold `capacity` points """
+        size = len(self._mouse_trail_buffer)
+        if capacity > size:
+            # double the capacity of the storage
+            self._mouse_trail_buffer = np.resize(self._mouse_trail_buffer,
+                                                 (max(2*size, capacity), 2))
+        
+
     def extend_mouse_trail(self):
         """ extends the mouse trail using the current mouse position """
-        ground_line = self.ground.linestring
+        spacing = self.params['mouse/model_radius']
+        mouse_x, mouse_y = float(self.mouse_pos[0]), float(self.mouse_pos[1])
         
         # remove points which are in front of the mouse
-        if self.mouse_trail:
-            spacing = self.params['mouse/model_radius']
-            trail = np.array(self.mouse_trail)
-            
-            # get distance between the current point and the previous ones
-            dist = np.hypot(trail[:, 0] - self.mouse_pos[0],
-                            trail[:, 1] - self.mouse_pos[1])
-            points_close = (dist < spacing)
-                
-            # delete obsolete points
-            if np.any(points_close):
-                i = np.nonzero(points_close)[0][0]
-                del self.mouse_trail[i:]
+        if self._mouse_trail_length > 0:
+            self._mouse_trail_length = _truncate_trail(
+                self._mouse_trail_buffer, self._mouse_trail_length,
+                mouse_x, mouse_y, spacing)
            
         # check the two ends of the mouse trail
-        if self.mouse_trail:
+        trail = self.mouse_trail
+        if trail is not None:
             # move first point to ground
-            ground_point = curves.get_projection_point(ground_line,
-                                                       self.mouse_trail[0])
-            self.mouse_trail[0] = ground_point
-
-            # check whether a separate point needs to be inserted
-            p1, p2 = self.mouse_trail[-1], self.mouse_pos
-            if curves.point_distance(p1, p2) > spacing:
-                mid_point = (0.5*(p1[0] + p2[0]), 0.5*(p1[1] + p2[1]))
-                self.mouse_trail.append(mid_point)
-
-            # append the current point
-            self.mouse_trail.append(self.mouse_pos)
+            trail[0] = self.ground.get_projection_point(trail[0])
+
+            # append the current point and possibly a point in between
+            self._mouse_trail_reserve(self._mouse_trail_length + 2)
+            self._mouse_trail_length = _extend_trail(
+                self._mouse_trail_buffer, self._mouse_trail_length,
+                mouse_x, mouse_y, spacing)
             ground_dist = curves.curve_length(self.mouse_trail)
             
         else:
             # create a mouse trail if it is not too far from the ground
             # the latter can happen, when the mouse suddenly appears underground
-            ground_point = curves.get_projection_point(ground_line, self.mouse_pos)
+            ground_point = self.ground.get_projection_point(self.mouse_pos)
             ground_dist = curves.point_distance(ground_point, self.mouse_pos)
             if ground_dist < self.params['mouse/speed_max']:
                 self.mouse_trail = [ground_point, self.mouse_pos]
@@ -310,6 +389,7 @@ class ThirdPass(PassBase):
         state = {}
         margin = self.params['mouse/model_radius']/2
         mouse_radius = self.params['mouse/model_radius']
+        y_ground = self.ground.get_y(self.mouse_pos[0])
         
         # check the horizontal position
         if self.mouse_pos[0] > self.background.shape[1]//2:
@@ -318,7 +398,7 @@ class ThirdPass(PassBase):
             state['position_horizontal'] = 'left'
                 
         # compare y value of mouse and ground (y-axis points down)
-        if self.mouse_pos[1] > self.ground.get_y(self.mouse_pos[0]) + margin:
+        if self.mouse_pos[1] > y_ground + margin:
             # handle mouse trail
             ground_dist = self.extend_mouse_trail()
             
@@ -328,8 +408,8 @@ class ThirdPass(PassBase):
             # score the burrow based on its entry point
             if self.ground_idx is None:
                 # only necessary if mouse starts inside burrow
-                dist = np.linalg.norm(self.ground.points - self.mouse_pos[None, :], axis=1)
-                self.ground_idx = np.argmin(dist)
+                self.ground_idx = \
+                        self.ground.get_closest_point_index(self.mouse_pos)
             entry_point = self.ground.points[self.ground_idx]
             if entry_point[1] > self.ground.midline:
                 state['location'] = 'burrow'
@@ -337,16 +417,15 @@ class ThirdPass(PassBase):
                 state['location'] = 'dimple'
                 
             # check whether we are at the end of the burrow
-            for burrow in self.burrows:
-                dist = curves.point_distance(burrow.end_point, self.mouse_pos)
-                if dist < mouse_radius:
-                    state['location_detail'] = 'end point'
-                    break
+            end_points = self.get_burrow_end_points()
+            dist2 = ((end_points - self.mouse_pos)**2).sum(axis=1)
+            if np.any(dist2 < mouse_radius**2):
+                state['location_detail'] = 'end point'
             else:
                 state['location_detail'] = 'general'
 
         else: 
-            if self.mouse_pos[1] + 2*mouse_radius < self.ground.get_y(self.mouse_pos[0]):
+            if self.mouse_pos[1] + 2*mouse_radius < y_ground:
                 state['location'] = 'air'
             elif self.mouse_pos[1] < self.ground.midline:
                 state['location'] = 'hill'
@@ -355,13 +434,11 @@ class ThirdPass(PassBase):
             state['location_detail'] = 'general'
 
             # get index of the ground line
-            dist = np.linalg.norm(self.ground.points - self.mouse_pos[None, :], axis=1)
-            self.ground_idx = np.argmin(dist)
+            self.ground_idx = self.ground.get_closest_point_index(self.mouse_pos)
             # get distance from ground line
-            mouse_point = geometry.Point(self.mouse_pos)
-            ground_dist = self.ground.linestring.distance(mouse_point)
+            ground_dist = self.ground.get_distance(self.mouse_pos)
             # report the distance as negative, if the mouse is under the ground line
-            if self.mouse_pos[1] > self.ground.get_y(self.mouse_pos[0]):
+            if self.mouse_pos[1] > y_ground:
                 ground_dist *= -1
             
             # reset the mouse trail since the mouse is over the ground
@@ -369,8 +446,8 @@ class ThirdPass(PassBase):
             
         # determine whether the mouse is moving or not
         velocity = self.data['pass2/mouse_trajectory'].velocity[self.frame_id, :]
-        speed = np.hypot(velocity[0], velocity[1])
-        if speed > self.params['mouse/moving_threshold_pixel_frame']:
+        vx, vy = velocity
+        if vx*vx + vy*vy > self._cache['moving_threshold_squared']:
             state['dynamics'] = 'moving'
         else:
             state['dynamics'] = 'stationary'
@@ -385,10 +462,15 @@ class ThirdPass(PassBase):
 
 
     def get_ground_polygon_points(self):
-        """ returns a list of points marking the ground region """
-        width, height = self.video.size
-        ground_points = self.ground.get_polygon_points(height, 0, width)
-        return np.asarray(ground_points, np.int32)
+        """ returns a list of points marking the ground region. The result is
+        cached for the current ground profile """
+        ground, ground_points = self._cache.get('ground_polygon', (None, None))
+        if ground is not self.ground:
+            width, height = self.video.size
+            ground_points = self.ground.get_polygon_points(height, 0, width)
+            ground_points = np.asarray(ground_points, np.int32)
+            self._cache['ground_polygon'] = (self.ground, ground_points)
+        return ground_points
 
         # create a mask for the region below the current mask_ground profile
         ground_points = np.empty((len(self.ground) + 4, 2), np.int32)
@@ -401,15 +483,35 @@ class ThirdPass(PassBase):
         return ground_points
 
 
+    def get_ground_polygon(self):
+        """ returns a polygon marking the ground region. The result is cached
+        for the current ground profile """
+        ground, polygon = self._cache.get('ground_polygon_shape', (None, None))
+        if ground is not self.ground:
+            polygon = geometry.Polygon(self.get_ground_polygon_points())
+            self._cache['ground_polygon_shape'] = (self.ground, polygon)
+        return polygon
+
+
     def get_ground_mask(self):
-        """ returns a binary mask distinguishing the ground from the sky """
-        # build a mask with potential burrows
-        width, height = self.video.size
-        mask_ground = np.zeros((height, width), np.uint8)
+        """ returns a binary mask distinguishing the ground from the sky.
+        The mask is reused for subsequent calls and must not be modified """
+        mask_ground = self._cache.get('ground_mask')
+        if mask_ground is None:
+            # build a mask with potential burrows
+            width, height = self.video.size
+            mask_ground = np.zeros((height, width), np.uint8)
+            self._cache['ground_mask'] = mask_ground
+        elif self._cache.get('ground_mask_ground') is self.ground:
+            # the ground did not change since the mask was created
+            return mask_ground
+        else:
+            mask_ground.fill(0)
         
         # create a mask for the region below the current mask_ground profile
         ground_points = self.get_ground_polygon_points()
         cv2.fillPoly(mask_ground, np.array([ground_points], np.int32), color=255)
+        self._cache['ground_mask_ground'] = self.ground
 
         return mask_ground
 
@@ -689,39 +791,53 @@ class ThirdPass(PassBase):
                 yield track_id, burrow_track.last
 
 
+    def get_burrow_end_points(self):
+        """ returns an array with the end points of all current burrows """
+        if 'burrow_end_points' not in self._cache:
+            end_points = [burrow.end_point for burrow in self.burrows]
+            end_points = np.array(end_points, np.double).reshape(-1, 2)
+            self._cache['burrow_end_points'] = end_points
+        return self._cache['burrow_end_points']
+
+
     def burrow_estimate_exit(self, burrow):
         """ estimate burrow exit points """
         
-        ground_line = self.ground.linestring
         dist_max = self.params['burrows/ground_point_distance']
         
         # determine burrow points close to the ground
-        exit_points = [point for point in burrow.contour
-                       if ground_line.distance(geometry.Point(point)) < dist_max]
+        contour = np.asarray(burrow.contour, np.double)
+        exit_points = contour[self.ground.get_distances(contour) < dist_max]
 
         if len(exit_points) < 2:
             return exit_points
-        
-        exit_points = np.array(exit_points)
 
         # cluster the points to detect multiple connections 
         # this is important when a burrow has multiple exits to the ground
         dist_max = self.params['burrows/width']
-        data = cluster.hierarchy.fclusterdata(exit_points, dist_max,
-                                              method='single', 
-                                              criterion='distance')
+        # single-linkage clusters are the connected components of the graph
+        # connecting all points closer than the threshold distance
+        tree = spatial.cKDTree(exit_points)
+        pairs = tree.query_pairs(dist_max, output_type='ndarray')
+        num_points = len(exit_points)
+        graph = sparse.coo_matrix((np.ones(len(pairs), bool),
+                                   (pairs[:, 0], pairs[:, 1])),
+                                  shape=(num_points, num_points))
+        num_clusters, labels = connected_components(graph, directed=False)
+        
+        # determine the size and the center of all clusters
+        exit_size = np.bincount(labels, minlength=num_clusters)
+        centers = np.empty((num_clusters, 2))
+        for k in xrange(2):
+            centers[:, k] = np.bincount(labels, weights=exit_points[:, k],
+                                        minlength=num_clusters)
+        centers /= exit_size[:, np.newaxis]
         
-        # find the exit points
-        exits, exit_size = [], []
-        for cluster_id in np.unique(data):
-            points = exit_points[data == cluster_id]
-            xm, ym = points.mean(axis=0)
-            dist = np.hypot(points[:, 0] - xm, points[:, 1] - ym)
-            exits.append(points[np.argmin(dist)])
-            exit_size.append(len(points))
-
-        exits = np.array(exits)
-        exit_size = np.array(exit_size)
+        # the exit is the point closest to the center of each cluster
+        dist = np.hypot(*(exit_points - centers[labels]).T)
+        order = np.lexsort((dist, labels))
+        cluster_start = np.cumsum(exit_size) - exit_size
+        exits = exit_points[order[cluster_start]]
 
         # return the exits sorted by their size
         return exits[np.argsort(-exit_size), :]
@@ -736,8 +852,7 @@ class ThirdPass(PassBase):
         mask, shift = burrow.get_mask(margin=2, dtype=np.int32, ret_offset=True)
         
         # move starting point onto ground line
-        ground_line = self.ground.linestring
-        point_start = curves.get_projection_point(ground_line, point_start)
+        point_start = self.ground.get_projection_point(point_start)
         point_start = (int(point_start[0]) - shift[0],
                        int(point_start[1]) - shift[1])
         mask[point_start[1], point_start[0]] = 1
@@ -749,33 +864,47 @@ class ThirdPass(PassBase):
         _, _, _, p_end = cv2.minMaxLoc(mask)
         
         # find an estimate for the centerline from the shortest distance from
-        # the end point to the burrow exit
+        # the end point to the burrow exit in global coordinates
         points = regions.shortest_path_in_distance_map(mask, p_end)
+        points = np.asarray(points, np.int32).reshape(-1, 2) + shift
 
-        # translate the points back to global coordinates 
-        centerline = curves.translate_points(points, shift[0], shift[1])
         # save centerline such that burrow exit is first point
-        centerline = centerline[::-1]
+        centerline = np.empty((len(points) + 1, 2), np.int32)
+        centerline[1:] = points[::-1]
         
         # add points that might be outside of the burrow contour
-        ground_start = curves.get_projection_point(ground_line, centerline[0])
-        if isinstance(centerline, np.ndarray):
-            centerline = np.insert(centerline, 0, ground_start).reshape(-1, 2)
-        else:
-            centerline.insert(0, ground_start)
+        centerline[0] = self.ground.get_projection_point(centerline[1])
             
         # simplify the curve        
-        centerline = cv2.approxPolyDP(np.array(centerline, np.int),
+        centerline = cv2.approxPolyDP(centerline.reshape(-1, 1, 2),
                                       epsilon=1, closed=False)
             
         # save the centerline in the burrow structure
-        burrow.centerline = centerline[:, 0, :]
+        burrow.centerline = centerline.reshape(-1, 2)
                                 
                         
     def store_burrows(self):
         """ associates the current burrows with burrow tracks """
         burrow_tracks = self.result['burrows/tracks']
-        ground_polygon = geometry.Polygon(self.get_ground_polygon_points())
+        ground_polygon = self.get_ground_polygon()
+        ground_prepared = prep(ground_polygon)
+        
+        # build a spatial index of the active burrows. Tracks that are changed
+        # in the loop below are collected in `tracks_changed` and are tested
+        # separately, since the index still refers to their old burrows
+        burrows_active = dict(self.active_burrows())
+        if burrows_active:
+            polygons = [burrow_last.polygon
+                        for burrow_last in burrows_active.itervalues()]
+            polygon_tracks = {id(polygon): track_id
+                              for polygon, track_id in zip(polygons,
+                                                           burrows_active)}
+            burrows_index = STRtree(polygons)
+        tracks_changed = set()
+        
+        # enclosing outlines of the burrow polygons, keyed by the polygon
+        outlines_prev = self._cache.get('burrow_outlines', {})
+        outlines = {}
         
         # check whether we already know this burrow
         # the burrows in self.burrows will always be larger than the burrows
@@ -783,9 +912,19 @@ class ThirdPass(PassBase):
         # burrow overlaps two older burrows, but the reverse cannot be true
         for burrow in self.burrows:
             # find all tracks to which this burrow may belong
-            track_ids = [track_id 
-                         for track_id, burrow_last in self.active_burrows()
-                         if burrow_last.intersects(burrow)]
+            burrow_prepared = prep(burrow.polygon)
+            track_ids = set()
+            if burrows_active:
+                for polygon in burrows_index.query(burrow.polygon):
+                    track_id = polygon_tracks[id(polygon)]
+                    if (track_id not in tracks_changed and
+                            _prepared_intersects(burrow_prepared, polygon)):
+                        track_ids.add(track_id)
+            for track_id in tracks_changed:
+                burrow_last = burrow_tracks[track_id].last
+                if _prepared_intersects(burrow_prepared, burrow_last.polygon):
+                    track_ids.add(track_id)
+            track_ids = sorted(track_ids)
             
             if len(track_ids) > 1:
                 # merge all burrows to a single track and keep the largest one
@@ -799,19 +938,29 @@ class ThirdPass(PassBase):
                     burrow.merge(burrow_last)
                         
             # only keep the burrow parts that are below the ground line
-            try:
-                polygon = burrow.polygon.intersection(ground_polygon)
-            except geos.TopologicalError:
-                continue
+            if ground_prepared.contains(burrow.polygon):
+                # the burrow lies completely below the ground line
+                polygon = burrow.polygon
+            else:
+                try:
+                    polygon = burrow.polygon.intersection(ground_polygon)
+                except geos.TopologicalError:
+                    continue
             if polygon.is_empty:
                 continue
             
-            try:
-                burrow.contour = regions.get_enclosing_outline(polygon)
-            except TypeError:
-                # can occur in corner cases where the enclosing outline cannot
-                # be found
-                continue
+            # reuse the outline of the last call if the burrow did not change
+            polygon_key = polygon.wkb
+            contour = outlines_prev.get(polygon_key)
+            if contour is None:
+                try:
+                    contour = regions.get_enclosing_outline(polygon)
+                except TypeError:
+                    # can occur in corner cases where the enclosing outline
+                    # cannot be found
+                    continue
+            outlines[polygon_key] = contour
+            burrow.contour = np.array(contour, np.double)
             
             # make sure that the burrow centerline lies within the ground region
             if burrow.linestring.length > 0:
@@ -821,8 +970,8 @@ class ThirdPass(PassBase):
             
             if isinstance(line, geometry.multilinestring.MultiLineString):
                 # pick the longest line if there are multiple
-                index_longest = np.argmax(l.length for l in line)
-                line = line[index_longest]
+                lengths = np.array([l.length for l in line.geoms])
+                line = line.geoms[int(np.argmax(lengths))]
 
             is_line = isinstance(line, geometry.linestring.LineString)
             if not is_line or line.is_empty or line.length <= 1:
@@ -840,7 +989,7 @@ class ThirdPass(PassBase):
                 # it could be that the whole line was underground
                 # => move the first data point onto the ground line
                 line = np.array(line, np.double)
-                line[0] = curves.get_projection_point(self.ground.linestring, line[0])
+                line[0] = self.ground.get_projection_point(line[0])
                 # set the updated burrow centerline
                 burrow.centerline = line
             
@@ -849,21 +998,37 @@ class ThirdPass(PassBase):
                 if len(track_ids) > 1:
                     # add the burrow to the longest track
                     burrow_tracks[track_longest].append(self.frame_id, burrow)
+                    tracks_changed.add(track_longest)
                 elif len(track_ids) == 1:
                     # add the burrow to the matching track
                     burrow_tracks[track_ids[0]].append(self.frame_id, burrow)
+                    tracks_changed.add(track_ids[0])
                 else:
                     # create the burrow track
                     burrow_track = BurrowTrack(self.frame_id, burrow)
                     burrow_tracks.append(burrow_track)
+                    tracks_changed.add(len(burrow_tracks) - 1)
                 
         # use the new set of burrows in the next iterations
         self.burrows = [b.copy()
                         for _, b in self.active_burrows(time_interval=0)]
+        self._burrow_bounds = self._get_burrow_bounds()
+        self._cache['burrow_outlines'] = outlines
+        self._cache.pop('burrow_end_points', None)
                 
           
-    def extend_burrow_by_mouse_trail(self, burrow):
-        """ takes a burrow shape and extends it using the current mouse trail """
+    def _get_burrow_bounds(self):
+        """ returns an array with the bounding boxes of all current burrows.
+        Each row contains the values (x_min, y_min, x_max, y_max) """
+        bounds = [burrow.polygon.bounds for burrow in self.burrows]
+        return np.array(bounds, np.double).reshape(-1, 4)
+    
+    
+    def extend_burrow_by_mouse_trail(self, burrow, mouse_trail=None,
+                                     mouse_trail_buffered=None):
+        """ takes a burrow shape and extends it using the current mouse trail.
+        The line string of the mouse trail and its buffered version can be
+        supplied to avoid calculating them again """
         if 'cage_interior_rectangle' in self._cache:
             cage_interior_rect = self._cache['cage_interior_rectangle']
         else:
@@ -873,9 +1038,11 @@ class ThirdPass(PassBase):
             self._cache['cage_interior_rectangle'] = cage_interior_rect
         
         # get the buffered mouse trail
-        trail_width = self.params['burrows/width_min']
-        mouse_trail = geometry.LineString(self.mouse_trail)
-        mouse_trail_buffered = mouse_trail.buffer(trail_width)
+        if mouse_trail is None:
+            mouse_trail = geometry.LineString(self.mouse_trail)
+        if mouse_trail_buffered is None:
+            trail_width = self.params['burrows/width_min']
+            mouse_trail_buffered = mouse_trail.buffer(trail_width)
         
         # extend the burrow contour by the mouse trail and restrict it to the
         # cage interior
@@ -899,40 +1066,66 @@ class ThirdPass(PassBase):
             # mouse trail is unknown => we don't have enough information 
             return
         
+        # the burrows will be modified below
+        self._cache.pop('burrow_end_points', None)
+        
+        width = self.params['burrows/width']
+        width_min = self.params['burrows/width_min']
+        
         # check whether we already know this burrow
         burrows_with_mouse = []
         trail_line = geometry.LineString(self.mouse_trail)
+        trail_buffered = trail_line.buffer(width_min)
         
-        for burrow_id, burrow in enumerate(self.burrows):
+        # the mouse is inside all burrows that are closer than the burrow
+        # width to the mouse trail. The exact distance is only calculated for
+        # burrows whose bounding box is close to the mouse trail
+        x_min, y_min, x_max, y_max = trail_line.bounds
+        bounds = self._burrow_bounds
+        candidates = ((bounds[:, 0] <= x_max + width) &
+                      (bounds[:, 1] <= y_max + width) &
+                      (bounds[:, 2] >= x_min - width) &
+                      (bounds[:, 3] >= y_min - width))
+        for burrow_id in np.flatnonzero(candidates):
             # determine whether we are inside this burrow
-            dist = burrow.polygon.distance(trail_line)
-            if dist < self.params['burrows/width']:
-                burrows_with_mouse.append(burrow_id)
+            dist = self.burrows[burrow_id].polygon.distance(trail_line)
+            if dist < width:
+                burrows_with_mouse.append(int(burrow_id))
 
         if burrows_with_mouse:
             # extend the burrow in which the mouse is
             burrow_mouse = self.burrows[burrows_with_mouse[0]]
-            self.extend_burrow_by_mouse_trail(burrow_mouse)
+            self.extend_burrow_by_mouse_trail(burrow_mouse, trail_line,
+                                              trail_buffered)
             
             # merge all the other burrows into this one
             # Note that burrows_with_mouse has increasing burrow_ids
+            burrows_merged = set(burrows_with_mouse[1:])
             for burrow_id in reversed(burrows_with_mouse[1:]):
                 self.logger.info('Merge burrow `%d` into `%d`', burrow_id,
                                  burrows_with_mouse[0])
                 burrow_mouse.merge(self.burrows[burrow_id])
-                del self.burrows[burrow_id]
+            if burrows_merged:
+                self.burrows = [burrow
+                                for burrow_id, burrow in enumerate(self.burrows)
+                                if burrow_id not in burrows_merged]
+                self._burrow_bounds = np.delete(self._burrow_bounds,
+                                                list(burrows_merged), axis=0)
+            burrow_mouse_id = burrows_with_mouse[0]
                 
         else:
             # create the burrow, since we don't know it yet
-            trail_width = self.params['burrows/width_min']
-            mouse_trail_buffered = trail_line.buffer(trail_width)
-            contour = mouse_trail_buffered.boundary.coords
+            contour = trail_buffered.boundary.coords
 
             burrow_mouse = Burrow(contour, centerline=self.mouse_trail)
             self.burrows.append(burrow_mouse)
+            self._burrow_bounds = np.vstack((self._burrow_bounds,
+                                             np.zeros((1, 4))))
+            burrow_mouse_id = len(self.burrows) - 1
 
         # simplify the burrow contour
         burrow_mouse.simplify_outline(tolerance=0.001)
+        self._burrow_bounds[burrow_mouse_id] = burrow_mouse.polygon.bounds
 
                                         
     #===========================================================================
@@ -988,14 +1181,14 @@ class ThirdPass(PassBase):
                                        'w', thickness=1)
             
             # indicate the current mouse trail    
-            if self.mouse_trail:
+            if self.mouse_trail is not None:
                 debug_video.add_line(self.mouse_trail, 'b', is_closed=False,
                                      mark_points=True, width=2)                
                 
             # indicate the currently active burrow shapes
             if self.params['burrows/enabled_pass3']:
                 for _, burrow in self.active_burrows():
-                    if hasattr(burrow, 'elongated') and burrow.elongated:
+                    if burrow.elongated:
                         burrow_color = 'red'
                     else:
                         burrow_color = 'DarkOrange'
@@ -241,21 +241,18 @@ class FourthPass(PassBase):
         points lying on the burrow contour
         """
         
-        ground_line = self.ground.linestring
         dist_max = self.params['burrows/ground_point_distance']
         #/2
 #         dist_max = dist + self.params['burrows/width']
         
         contour = curves.make_curve_equidistant(contour, spacing=2)
+        contour = np.asarray(contour, np.double)
         
         # determine burrow points close to the ground
-        exit_points = [point for point in contour
-                       if ground_line.distance(geometry.Point(point)) < dist_max]
+        exit_points = contour[self.ground.get_distances(contour) < dist_max]
 
         if len(exit_points) < 2:
             return exit_points
-        
-        exit_points = np.array(exit_points)
 
         # cluster the points to detect multiple connections 
         # this is important when a burrow has multiple exits to the ground
@@ -827,7 +824,6 @@ class FourthPass(PassBase):
         """ finds burrows using the previous estimate from pass3 and adapting
         it to the image using an active contour model """
         burrow_tracks = self.result['burrows/tracks']
-        ground_line = self.ground.linestring
         dist_max = self.params['burrows/ground_point_distance']
         parameters = self.params['burrows/active_contour']
         
@@ -849,9 +845,8 @@ class FourthPass(PassBase):
             ac.set_potential(gradient_strength)
 
             # find the points close to the ground line, which will be anchored
-            ground_line = self.ground.linestring
-            anchor_idx = [idx for idx, point in enumerate(burrow.contour)
-                          if ground_line.distance(geometry.Point(point)) < dist_max]
+            dists = self.ground.get_distances(burrow.contour)
+            anchor_idx = np.flatnonzero(dists < dist_max).tolist()
 
             # adapt the contour
             burrow.contour = ac.find_contour(burrow.contour, anchor_idx, anchor_idx)
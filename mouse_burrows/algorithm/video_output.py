@@ -0,0 +1,75 @@
+'''
+Contains helper classes for writing debug videos without blocking the analysis
+'''
+
+from __future__ import division
+
+import Queue
+import threading
+
+
+
+class ThreadedVideoComposer(object):
+    """ wraps a video composer such that all its methods are executed in a
+    separate thread. Method calls are queued and executed in the order in which
+    they were issued. Consequently, the return values of the methods are lost
+    and the data passed to them must not be modified afterwards. Only the
+    methods of the underlying composer can be accessed, since its attributes
+    might be in an undefined state while the worker thread is running.
+    """
+
+    _sentinel = object()
+
+    def __init__(self, composer, queue_size=16):
+        """ initializes the composer wrapper.
+        `composer` is the video composer whose methods are called
+        `queue_size` is the maximal number of pending method calls. Further
+            calls block until the worker thread caught up.
+        """
+        self.composer = composer
+        self._queue = Queue.Queue(maxsize=queue_size)
+        self._error = None
+        self._thread = threading.Thread(target=self._worker)
+        self._thread.daemon = True
+        self._thread.start()
+
+
+    def _worker(self):
+        """ executes the queued method calls """
+        while True:
+            job = self._queue.get()
+            if job is self._sentinel:
+                break
+            if self._error is None:
+                name, args, kwargs = job
+                try:
+                    getattr(self.composer, name)(*args, **kwargs)
+                except Exception as err:
+                    # store the error, such that it can be raised in the
+                    # main thread when the composer is closed
+                    self._error = err
+
+
+    def __getattr__(self, name):
+        """ returns a function that queues calls to the method `name` """
+        if not callable(getattr(self.composer, name)):
+            raise AttributeError('Attribute `%s` cannot be accessed '
+                                 'asynchronously' % name)
+
+        def queue_call(*args, **kwargs):
+            """ queue the method call """
+            self._queue.put((name, args, kwargs))
+
+        return queue_call
+
+
+    def close(self):
+        """ waits for all pending method calls and closes the composer """
+        self._queue.put(self._sentinel)
+        self._thread.join()
+        try:
+            if self._error is not None:
+                raise self._error
+        finally:
+            self.composer.close()
+
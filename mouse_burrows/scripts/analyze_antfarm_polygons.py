@@ -14,14 +14,15 @@ import functools
 import logging
 import multiprocessing as mp
 import os.path
-import operator
 import sys
 import traceback
 
 import cv2
 import numpy as np
-from scipy import cluster, ndimage, spatial
+from scipy import sparse, spatial
+from scipy.sparse.csgraph import connected_components
 from shapely import geometry
+from shapely.prepared import prep
 import pint
 
 # add the root of the video-analysis project to the path
@@ -68,6 +69,9 @@ ScaleBar = collections.namedtuple('ScaleBar', ['size', 'angle'])
 class AntfarmShapes(object):
     """ class that manages shapes in an antfarm """
 
+    # structuring elements shared by all instances
+    _kernel_cache = {}
+
     def __init__(self, parameters=None, name=''):
         """ initializes the polygon collection
         `polygons` is a list of polygons
@@ -76,7 +80,7 @@ class AntfarmShapes(object):
         `debug_output` can be a folder to which debug output will be written
         """
         self.name = name
-        self.image = None
+        self.image = None #< image in BGR ordering as returned by OpenCV
 
         self.burrows = []
         self.ground_line = None
@@ -103,14 +107,17 @@ class AntfarmShapes(object):
         if ext == '.jpg' or ext == '.png':
             logging.debug('Use OpenCV image loader to read file `%s`', path)
 
-            img = cv2.imread(path)
-            obj.image = cv2.cvtColor(img, cv2.COLOR_BGR2RGB) #< convert to RGB
+            # keep the image in BGR ordering to avoid converting it
+            obj.image = cv2.imread(path)
 
             # remove some part of the border if requested
             remove_border = obj.params['image/remove_border']
             if remove_border > 0:
-                obj.image = obj.image[remove_border:-remove_border,
-                                      remove_border:-remove_border]
+                # copy the image, since OpenCV cannot draw on the view
+                obj.image = np.ascontiguousarray(
+                    obj.image[remove_border:-remove_border,
+                              remove_border:-remove_border]
+                )
 
             obj.filename = filename
 
@@ -124,22 +131,27 @@ class AntfarmShapes(object):
 
     def analyze_image(self):
         """ load the data from an image """
-        # load parameters
-        color_scale_bar = self.params['colors/scale_bar']
-        color_ground_line = self.params['colors/ground_line']
-        color_burrow = self.params['colors/burrow']
+        # load parameters and convert the colors to the BGR ordering
+        color_scale_bar = self.params['colors/scale_bar'][::-1]
+        color_ground_line = self.params['colors/ground_line'][::-1]
+        color_burrow = self.params['colors/burrow'][::-1]
+
+        # isolate all colors in a single pass over the image. Holes do not
+        # need to be filled for the scale bar, since only its outer contour
+        # is used
+        dilate = self.params['colors/isolation_closing_radius']
+        scale_mask, ground_mask, burrow_mask = self.isolate_colors(
+            self.image, [color_scale_bar, color_ground_line, color_burrow],
+            dilate=[0, dilate, 0], fill_holes=[False, True, True]
+        )
 
         # find the scale bar
-        scale_mask = self.isolate_color(self.image, color_scale_bar)
         self.scale_bar = self.get_scalebar_from_image(scale_mask)
 
         # find the ground line
-        dilate = self.params['colors/isolation_closing_radius']
-        ground_mask = self.isolate_color(self.image, color_ground_line, dilate=dilate)
         self.ground_line = self.get_groundline_from_image(ground_mask)
 
         # find all the burrows
-        burrow_mask = self.isolate_color(self.image, color_burrow)
         self.burrows = self.get_burrows_from_image(burrow_mask, self.ground_line)
 
         # determine additional burrow properties
@@ -184,18 +196,22 @@ class AntfarmShapes(object):
         # get distance map from centerline
         distance_map, offset = burrow.get_mask(margin=2, dtype=np.uint16,
                                                ret_offset=True)
+        offset = np.array(offset, np.double)
         cline = burrow.centerline
-        start_points = curves.translate_points(cline, -offset[0], -offset[1])
+        start_points = np.array(cline, np.double)
+        start_points -= offset
         regions.make_distance_map(distance_map, start_points)
 
         # determine endpoints, which are not already part of the centerline
-        end_coords = np.array([ep.coords for ep in endpoints])
-        dists = spatial.distance.cdist(end_coords, cline)
-        extra_ends = end_coords[dists.min(axis=1) > burrow_width, :].tolist()
-        extra_ends = curves.translate_points(extra_ends, -offset[0], -offset[1])
+        end_coords = np.array([ep.coords for ep in endpoints]).reshape(-1, 2)
+        diff = end_coords[:, None, :] - np.asarray(cline)[None, :, :]
+        dists2 = np.einsum('ijk,ijk->ij', diff, diff).min(axis=1)
+        extra_ends = end_coords[dists2 > burrow_width**2, :] - offset
+        extra_ends = extra_ends.tolist()
 
         # get additional points that are far away from the centerline
-        map_max = ndimage.filters.maximum_filter(distance_map, burrow_width)
+        kernel = self._get_structuring_element(cv2.MORPH_RECT, burrow_width)
+        map_max = cv2.dilate(distance_map, kernel)
         map_maxima =  (distance_map == map_max) & (distance_map > min_length)
         maxima = np.array(np.nonzero(map_maxima)).T
 
@@ -205,50 +221,63 @@ class AntfarmShapes(object):
         else:
             outside = geometry.MultiPoint(end_coords)
 
-        # define a helper function for checking the connection to the ground
-        burrow_poly = burrow.polygon.buffer(2)
-        def _direct_conn_to_ground(point, has_offset=False):
+        # define a helper function for checking the connection to the ground.
+        # The prepared polygon speeds up the repeated containment tests, which
+        # are equivalent to testing whether the line is within the polygon
+        burrow_poly = prep(burrow.polygon.buffer(2))
+            
+        def _direct_conn_to_ground(points, has_offset=False):
             """ helper function checking the connection to the ground """
+            points = np.array(points, np.double).reshape(-1, 2)
             if has_offset:
-                point = (point[0] + offset[0], point[1] + offset[1])
-            p_ground = curves.get_projection_point(outside, point)
-            conn_line = geometry.LineString([point, p_ground])
-            return conn_line.length < 1 or conn_line.within(burrow_poly)
+                points += offset
+                
+            result = np.empty(len(points), np.bool)
+            for k, point in enumerate(points):
+                point = tuple(point)
+                p_ground = curves.get_projection_point(outside, point)
+                conn_line = geometry.LineString([point, p_ground])
+                result[k] = (conn_line.length < 1 or
+                             burrow_poly.contains(conn_line))
+            return result
 
         branch_points = []
         branch_point_separation = self.params['burrow/branch_point_separation']
         if maxima.size > 0:
-            if len(maxima) == 1:
-                clusters = [0]
-            else:
-                # cluster maxima to reduce them to single end points
-                # this is important when a burrow has multiple exits to the ground
-                clusters = cluster.hierarchy.fclusterdata(
-                    maxima, branch_point_separation,
-                    method='single', criterion='distance'
-                )
-
-            cluster_ids = np.unique(clusters)
-            logging.debug('Found %d possible branch point(s)' % len(cluster_ids))
+            # cluster maxima to reduce them to single end points
+            # this is important when a burrow has multiple exits to the ground
+            # single-linkage clusters are the connected components of the graph
+            # connecting all maxima closer than the separation distance
+            tree = spatial.cKDTree(maxima)
+            pairs = tree.query_pairs(branch_point_separation,
+                                     output_type='ndarray')
+            num_maxima = len(maxima)
+            graph = sparse.coo_matrix((np.ones(len(pairs), bool),
+                                       (pairs[:, 0], pairs[:, 1])),
+                                      shape=(num_maxima, num_maxima))
+            clusters = connected_components(graph, directed=False)[1]
+
+            # get the point with maximal distance from the center line in each
+            # cluster by sorting the maxima by cluster and decreasing distance
+            dists = distance_map[maxima[:, 0], maxima[:, 1]].astype(np.int64)
+            order = np.lexsort((-dists, clusters))
+            is_first = np.r_[True, np.diff(clusters[order]) != 0]
+            candidates = maxima[order[is_first]]
+            logging.debug('Found %d possible branch point(s)' % len(candidates))
 
             # find the additional point from the clusters
-            for cluster_id in cluster_ids:
-                candidates = maxima[clusters == cluster_id, :]
-
-                # get point with maximal distance from center line
-                dists = [distance_map[x, y] for x, y in candidates]
-                y, x = candidates[np.argmax(dists)]
-
+            for y, x in candidates:
                 # check whether this point is close to an endpoint
                 point = geometry.Point(x + offset[0], y + offset[1])
                 branch_depth = point.distance(outside)
                 if (branch_depth > min_length or
-                        not _direct_conn_to_ground((x, y), has_offset=True)):
+                        not _direct_conn_to_ground((x, y), has_offset=True)[0]):
                     branch_points.append((x, y))
 
             # save some output for debugging
-            self._debug['possible_branches'] = \
-                    curves.translate_points(branch_points, offset[0], offset[1])
+            possible_branches = np.array(branch_points, np.double)
+            possible_branches = possible_branches.reshape(-1, 2) + offset
+            self._debug['possible_branches'] = possible_branches
 
         # find the burrow branches
         burrow.branches = []
@@ -265,7 +294,8 @@ class AntfarmShapes(object):
             # connect all additional points to the centerline -> branches
             for ep_id, ep in gen:
                 line = regions.shortest_path_in_distance_map(distance_map, ep)
-                line = curves.translate_points(line, offset[0], offset[1])
+                line = np.array(line, np.double)
+                line += offset
 
                 # estimate the depth of the branch
                 depth = max(geometry.Point(p).distance(outside)
@@ -276,9 +306,7 @@ class AntfarmShapes(object):
                 # the branch and ground line are fully contained in the burrow
                 # polygon
                 if ep_id == 1 and depth < min_length:
-                    num_direct = sum(1 for p_branch in line
-                                     if _direct_conn_to_ground(p_branch))
-                    ratio_direct = num_direct / len(line)
+                    ratio_direct = _direct_conn_to_ground(line).mean()
                     if ratio_direct > 0.75:
                         # the ground is directly reachable from most points
                         line = None
@@ -323,12 +351,12 @@ class AntfarmShapes(object):
             # draw the smooth centerline
             cline = burrow.centerline
             cv2.polylines(self.image, [np.array(cline, np.int)],
-                          isClosed=False, color=(255, 0, 0), thickness=3)
+                          isClosed=False, color=(0, 0, 255), thickness=3)
 
             # mark the end points
             for e_p in burrow.endpoints:
                 if e_p.is_exit:
-                    color = (0, 0, 255)
+                    color = (255, 0, 0)
                 else:
                     color = (0, 255, 0)
                 coords = tuple([int(c) for c in e_p.coords])
@@ -344,9 +372,7 @@ class AntfarmShapes(object):
         """ write the debug output image to file """
         self.add_debug_output()
 
-        img = cv2.cvtColor(self.image, cv2.COLOR_RGB2BGR) #< convert to BGR
-
-        cv2.imwrite(filename, img)
+        cv2.imwrite(filename, self.image)
 
         logging.info('Wrote output file `%s`' % filename)
 
@@ -354,18 +380,18 @@ class AntfarmShapes(object):
     def show_debug_image(self):
         """ shows the debug image on screen """
         self.add_debug_output()
-        debug.show_image(self.image)
+        debug.show_image(self.image[:, :, ::-1]) #< convert to RGB
 
 
     def _get_line_from_contour(self, contour):
         """ determines a line described by a contour """
-        # calculate the distance between all points on this contour
-        dist = spatial.distance.pdist(contour, 'euclidean')
-        dist = spatial.distance.squareform(dist)
+        # build a tree to find the neighbors of points on this contour
+        contour = np.asarray(contour, np.double)
+        tree = spatial.cKDTree(contour)
 
         # start from the left most point and find all points
         p_cur = np.argmin(contour[:, 0])
-        p_avail = np.ones(len(contour), np.bool)
+        p_avail = np.ones(len(contour), bool)
         p_avail[p_cur] = False
 
         points = []
@@ -374,13 +400,16 @@ class AntfarmShapes(object):
             points.append(contour[p_cur, :])
 
             # find the closest points
-            p_close = np.where((dist[p_cur, :] < 4) & p_avail)[0]
+            p_close = np.array(sorted(tree.query_ball_point(contour[p_cur], 4)),
+                               np.intp)
+            p_close = p_close[p_avail[p_close]]
+            dist = np.hypot(*(contour[p_close] - contour[p_cur]).T)
+            p_close, dist = p_close[dist < 4], dist[dist < 4]
             if len(p_close) == 0:
                 break
 
             # find the next point
-            k = np.argmax(dist[p_cur, p_close])
-            p_cur = p_close[k]
+            p_cur = p_close[np.argmax(dist)]
 
             # remove all old points that are in the same surrounding
             p_avail[p_close] = False
@@ -446,6 +475,8 @@ class AntfarmShapes(object):
 
         # get a polygon for cutting away the sky
         above_ground = ground_line.get_polygon(0, left=0, right=width)
+        # polygons below this line cannot intersect the sky (y-axis points down)
+        ground_y_max = np.asarray(ground_line.points)[:, 1].max()
 
         # determine contours in the mask
         contours = cv2.findContours(mask, cv2.RETR_EXTERNAL,
@@ -468,11 +499,14 @@ class AntfarmShapes(object):
                 at_left = (rect.left < self.params['scale_bar/dist_left']*width)
                 max_dist_bottom = self.params['scale_bar/dist_bottom']
                 at_bottom = (rect.bottom > (1 - max_dist_bottom) * height)
-                hull = cv2.convexHull(contour)
-                hull_area = cv2.contourArea(hull)
-                is_simple = (hull_area < 2*area)
 
-                if at_left and at_bottom and is_simple:
+                if at_left and at_bottom:
+                    hull_area = cv2.contourArea(cv2.convexHull(contour))
+                    is_simple = (hull_area < 2*area)
+                else:
+                    is_simple = False
+
+                if is_simple:
                     # the current polygon is the scale bar
                     _, (w, h), _ = cv2.minAreaRect(contour)
 
@@ -493,7 +527,8 @@ class AntfarmShapes(object):
                 burrow_poly = regions.regularize_polygon(burrow_poly)
 
                 # build the burrow polygon by removing the sky
-                burrow_poly = burrow_poly.difference(above_ground)
+                if burrow_poly.bounds[1] <= ground_y_max:
+                    burrow_poly = burrow_poly.difference(above_ground)
 
                 # create a burrow from the outline
                 boundary = regions.get_enclosing_outline(burrow_poly)
@@ -510,9 +545,27 @@ class AntfarmShapes(object):
         return burrows
 
 
-    def isolate_color(self, img, color, white_background=None, dilate=0):
-        """ isolates a certain color channel from the image. Color should be a
-        binary vector only containing 0 and 1 """
+    def _get_structuring_element(self, shape, size):
+        """ returns a square structuring element of the given `shape` and
+        `size`. The elements are cached, since they are used for every image
+        """
+        key = (shape, size)
+        try:
+            kernel = self._kernel_cache[key]
+        except KeyError:
+            kernel = cv2.getStructuringElement(shape, (size, size))
+            self._kernel_cache[key] = kernel
+        return kernel
+
+
+    def isolate_colors(self, img, colors, white_background=None, dilate=None,
+                       fill_holes=None):
+        """ isolates several color channels from the image in a single pass.
+        `colors` is a list of binary vectors only containing 0 and 1
+        `dilate` is a list with the amount of dilation for each color
+        `fill_holes` is a list of flags determining for each color whether
+            holes in the objects are filled
+        Returns a list with a mask for each color """
         # determine whether the background is white or black if not given
         if white_background is None:
             white_background = (np.mean(img) > 128)
@@ -531,30 +584,64 @@ class AntfarmShapes(object):
         else: # dark background
             limits_absent = (0, 30)
             limits_present = (30, 255)
-        limits = (limits_absent, limits_present)
-        bounds = np.array([limits[int(c)] for c in color], np.uint8)
 
-        # find the mask highlighting the respective colors
-        mask = cv2.inRange(img, bounds[:, 0], bounds[:, 1])
+        # compare all color channels with the limits only once. The outer
+        # bounds of the limits are always satisfied by uint8 images
+        channel_present = (img >= limits_present[0])
+        channel_absent = (img <= limits_absent[1])
+
+        if dilate is None:
+            dilate = [0] * len(colors)
+        if fill_holes is None:
+            fill_holes = [True] * len(colors)
+
+        masks = []
+        for color, color_dilate, color_fill in zip(colors, dilate, fill_holes):
+            # find the mask highlighting the respective colors
+            mask = np.ones(img.shape[:2], bool)
+            for c, present in enumerate(color):
+                if present:
+                    mask &= channel_present[:, :, c]
+                else:
+                    mask &= channel_absent[:, :, c]
+            mask = mask.astype(np.uint8) * 255
 
+            masks.append(self._close_color_mask(mask, color_dilate,
+                                                color_fill))
+
+        return masks
+
+
+    def isolate_color(self, img, color, white_background=None, dilate=0,
+                      fill_holes=True):
+        """ isolates a certain color channel from the image. Color should be a
+        binary vector only containing 0 and 1 """
+        return self.isolate_colors(img, [color], white_background,
+                                   [dilate], [fill_holes])[0]
+
+
+    def _close_color_mask(self, mask, dilate=0, fill_holes=True):
+        """ closes gaps in the outline of the objects in the mask of a color
+        and fills the objects if `fill_holes` is True """
         # dilate the mask to close gaps in the outline
         w = int(self.params['colors/isolation_closing_radius'])
-        kernel = cv2.getStructuringElement(cv2.MORPH_ELLIPSE,
-                                           (2*w + 1, 2*w + 1))
+        kernel = self._get_structuring_element(cv2.MORPH_ELLIPSE, 2*w + 1)
         mask_dilated = cv2.dilate(mask, kernel)
 
-        # fill the objects
-        contours = cv2.findContours(mask_dilated.copy(), cv2.RETR_EXTERNAL,
-                                    cv2.CHAIN_APPROX_SIMPLE)[1]
+        if fill_holes:
+            # fill the objects
+            contours = cv2.findContours(mask_dilated.copy(), cv2.RETR_EXTERNAL,
+                                        cv2.CHAIN_APPROX_SIMPLE)[1]
 
-        for contour in contours:
-            cv2.fillPoly(mask_dilated, [contour[:, 0, :]], color=(255, 255, 255))
+            for contour in contours:
+                cv2.fillPoly(mask_dilated, [contour[:, 0, :]],
+                             color=(255, 255, 255))
 
         # erode the mask and return it
         if dilate != 0:
             w = int(self.params['colors/isolation_closing_radius'] - dilate)
-            kernel = cv2.getStructuringElement(cv2.MORPH_ELLIPSE,
-                                               (2*w + 1, 2*w + 1))
+            kernel = self._get_structuring_element(cv2.MORPH_ELLIPSE,
+                                                   2*w + 1)
         mask = cv2.erode(mask_dilated, kernel)
 
         # make sure nothing touches the border
@@ -567,10 +654,8 @@ class AntfarmShapes(object):
         """ calculates the length of all exists of the given burrow """
         # identify all points that are close to the ground line
         dist_max = burrow.parameters['ground_point_distance']
-        g_line = self.ground_line.linestring
         points = burrow.contour
-        exitpoints = [g_line.distance(geometry.Point(point)) < dist_max
-                      for point in points]
+        exitpoints = self.ground_line.get_distances(points) < dist_max
 
         # find the indices of contiguous true regions
         indices = math.contiguous_true_regions(exitpoints)
@@ -679,8 +764,10 @@ class AntfarmShapes(object):
             # calculate some additional statistics
             perimeter_exit = self._get_burrow_exit_length(burrow)
             exit_count = sum(1 for ep in burrow.endpoints if ep.is_exit)
+            # branches with less than two points do not have a length
             branch_length = sum(curves.curve_length(points)
-                                for points in burrow.branches)
+                                for points in burrow.branches
+                                if len(points) > 1)
 
             # determine burrow angles and distance between end points
             angle1 = np.rad2deg(burrow.get_entry_angle(angle_dist_px))
@@ -740,7 +827,8 @@ def process_polygon_file(path, output_folder=None, suppress_exceptions=False,
     if suppress_exceptions:
         # run the function within a catch-all try-except-block
         try:
-            result = process_polygon_file(path, output_folder, False, debug)
+            result = process_polygon_file(path, output_folder, False, debug,
+                                          scale)
         except (KeyboardInterrupt, SystemExit):
             raise
         except:
@@ -769,6 +857,24 @@ def process_polygon_file(path, output_folder=None, suppress_exceptions=False,
 
 
 
+# arguments of `process_polygon_file` that are the same for all files analyzed
+# by a worker process
+_worker_arguments = {}
+
+
+def _init_worker(**kwargs):
+    """ stores the arguments shared by all jobs of a worker process """
+    _worker_arguments.update(kwargs)
+    # the cores are already used by the worker processes
+    cv2.setNumThreads(1)
+
+
+def _process_polygon_file_in_worker(path):
+    """ processes a single file in a worker process """
+    return process_polygon_file(path, **_worker_arguments)
+
+
+
 def main():
     """ main routine of the program """
     # parse the command line arguments
@@ -818,14 +924,25 @@ def main():
         logging.info('Analyzing %d files.' % len(files))
 
         # collect burrows from all files
-        if args.multiprocessing:
-            # use multiple processes to analyze data
-            job_func = functools.partial(process_polygon_file,
-                                         output_folder=args.folder,
-                                         suppress_exceptions=True,
-                                         scale=args.scale)
-            pool = mp.Pool()
-            results = pool.map(job_func, files)
+        if args.multiprocessing and len(files) > 1:
+            # use multiple processes to analyze data. The arguments shared by
+            # all files are passed to the workers only once
+            worker_arguments = {'output_folder': args.folder,
+                                'suppress_exceptions': True,
+                                'scale': args.scale}
+            pool = mp.Pool(min(len(files), mp.cpu_count()),
+                           initializer=functools.partial(_init_worker,
+                                                         **worker_arguments))
+            try:
+                # hand out the files one by one, since their analysis time
+                # varies strongly. The results are still returned in order
+                results = list(misc.display_progress(
+                    pool.imap(_process_polygon_file_in_worker, files,
+                              chunksize=1)
+                ))
+            finally:
+                pool.close()
+                pool.join()
 
         else:
             # analyze data in the current process
@@ -845,25 +962,35 @@ def main():
         # write complete results as pickle file if requested
         if args.result_pkl:
             with open(args.result_pkl, "wb") as fp:
-                pickle.dump(results, fp)
+                pickle.dump(results, fp, protocol=pickle.HIGHEST_PROTOCOL)
 
     # write burrow results as csv file if requested
     if args.result_csv:
-        # create a dictionary of lists
-        table = collections.defaultdict(list)
-        # iterate through all experiments and save information about the burrows
+        # iterate through all experiments and collect the burrows
+        rows = []
         for data in results:
             if data:
                 # sort the burrows from left to right
-                burrows = sorted(data['burrows'],
-                                 key=operator.itemgetter('pos_x'))
+                burrows = data['burrows']
+                pos_x = np.array([burrow['pos_x'] for burrow in burrows])
+                order = np.argsort(pos_x, kind='mergesort')
+                burrows = [burrows[k] for k in order]
                 # create a single row per burrow
                 for burrow_id, properties in enumerate(burrows, 1):
                     properties['burrow_id'] = burrow_id
                     properties['experiment'] = data['name']
-                    # iterate over all burrow properties
-                    for k, v in properties.iteritems():
-                        table[k].append(v)
+                    rows.append(properties)
+
+        # create a dictionary of lists with an entry for every burrow, such
+        # that missing properties do not shift the columns
+        columns = set()
+        for properties in rows:
+            columns.update(properties)
+        table = {k: [None] * len(rows) for k in columns}
+        for row_id, properties in enumerate(rows):
+            # iterate over all burrow properties
+            for k, v in properties.iteritems():
+                table[k][row_id] = v
 
         # write the data to a csv file
         first_columns = ['experiment', 'burrow_id']
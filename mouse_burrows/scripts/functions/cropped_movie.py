@@ -7,15 +7,18 @@ Created on Oct 18, 2015
 
 from __future__ import division
 
-import datetime
 import logging
+import string
 
 import numpy as np
 
 from ...simple import load_result_file
+from ...algorithm.video_output import ThreadedVideoComposer
+from .time_stamps import get_time_stamps
 from utils.misc import display_progress
 from video.filters import FilterCrop, FilterDropFrames
 from video.io import VideoComposer
+from video.io.parallel import VideoPreprocessor
 from video.analysis.shapes import Rectangle
 
 
@@ -23,7 +26,7 @@ from video.analysis.shapes import Rectangle
 def make_cropped_video(result_file, output_video=None,
                        display='{time} [{frame}]', scale_bar=True,
                        border_buffer_cm=0, frame_compression=1,
-                       time_duration=None, progress=True):
+                       time_duration=None, progress=True, use_threads=True):
     """ function that crops a video to an antfarm.
     
     `result_file` is the file where the results from the video analysis are
@@ -42,6 +45,8 @@ def make_cropped_video(result_file, output_video=None,
     `time_duration` sets the maximal number of seconds the video is supposed to
         last. Additional frames will not be written.
     `progress` flag that determines whether the progress is displayed
+    `use_threads` determines whether reading and writing the video is done in
+        separate threads, such that decoding and encoding overlap
     """
     logging.info('Analyze video `%s`', result_file)
     
@@ -100,10 +105,20 @@ def make_cropped_video(result_file, output_video=None,
     if video_bitrate is None:
         video_bitrate = analyzer.params['output/video/bitrate']
     fps = video_input.fps
-    video_output = VideoComposer(
+    composer = VideoComposer(
         output_video, size=video_input.size, fps=fps,
         is_color=video_input.is_color, codec=video_codec, bitrate=video_bitrate,
     )
+    if use_threads:
+        # encode the video in a separate thread
+        video_output = ThreadedVideoComposer(composer)
+    else:
+        video_output = composer
+    # bind the methods once, since the threaded composer creates a new
+    # function for every attribute access
+    set_frame = video_output.set_frame
+    add_rectangle = video_output.add_rectangle
+    add_text = video_output.add_text
     
     # time label position
     label_pos = video_input.width // 2, 30
@@ -111,49 +126,64 @@ def make_cropped_video(result_file, output_video=None,
     # calculate size of scale bar and the position of its label
     pixel_size_cm = analyzer.data['pass2/pixel_size_cm']
     scale_bar_size_cm = 10
-    scale_bar_size_px = np.round(scale_bar_size_cm / pixel_size_cm)
+    scale_bar_size_px = int(round(scale_bar_size_cm / pixel_size_cm))
     scale_bar_rect = Rectangle(30, 50, scale_bar_size_px, 5)
     scale_bar_pos = (30 + scale_bar_size_px//2, 30)
+    scale_bar_label = str('%g cm' % scale_bar_size_cm)
     
+    # determine which data needs to be calculated for the display
+    if display:
+        # format the display once, such that errors are reported before any
+        # frame has been written
+        display.format(frame=0, time='')
+        display_fields = set(field for _, field, _, _
+                             in string.Formatter().parse(display))
+    else:
+        display_fields = set()
+    
+    if 'time' in display_fields:
+        # calculate all time stamps at once
+        time_stamps = get_time_stamps(np.arange(len(video_input)), fps)
+    
+    # read the video in a separate thread
+    video_iter = VideoPreprocessor(video_input, functions={},
+                                   use_threads=use_threads)
     if progress:
-        video_input = display_progress(video_input)
+        video_iter = display_progress(video_iter)
     
-    for frame_id, frame in enumerate(video_input):
-        video_output.set_frame(frame, copy=True)
+    for frame_id, data in enumerate(video_iter):
+        # the frame needs to be copied, since the overlays are drawn onto it
+        # and since the frames are read ahead and encoded in other threads
+        set_frame(data['raw'], copy=True)
 
         if scale_bar:
             # show a scale bar
-            video_output.add_rectangle(scale_bar_rect, width=-1)
-            video_output.add_text(str('%g cm' % scale_bar_size_cm),
-                                  scale_bar_pos, color='w',
-                                  anchor='upper center')
+            add_rectangle(scale_bar_rect, width=-1)
+            add_text(scale_bar_label, scale_bar_pos, color='w',
+                     anchor='upper center')
 
         # gather data about this frame
         frame_data = {'frame': frame_id}
         
-        # calculate time stamp
-        time_secs, time_frac = divmod(frame_id, fps)
-        time_msecs = int(1000 * time_frac / fps)
-        dt = datetime.timedelta(seconds=time_secs,
-                                milliseconds=time_msecs)
-        frame_data['time'] = str(dt)
+        if 'time' in display_fields:
+            frame_data['time'] = time_stamps[frame_id]
             
         # output the display data
         if display:
             display_text = display.format(**frame_data)
-            video_output.add_text(display_text, label_pos, color='w',
-                                  anchor='upper center')
+            add_text(display_text, label_pos, color='w',
+                     anchor='upper center')
 
-    # show summary
-    frames_total = video_info['frames'][1] - video_info['frames'][0]
-    frames_written = video_output.frames_written
-    logging.info('%d (%d%%) of %d frames written', frames_written,
-                 100 * frames_written // frames_total, frames_total)
-    
     # close and finalize video
     try:
         video_output.close()
     except IOError:
         logging.exception('Error while writing out the debug video `%s`',
-                          video_output)
+                          composer)
+
+    # show summary
+    frames_total = video_info['frames'][1] - video_info['frames'][0]
+    frames_written = composer.frames_written
+    logging.info('%d (%d%%) of %d frames written', frames_written,
+                 100 * frames_written // frames_total, frames_total)
         
\ No newline at end of file
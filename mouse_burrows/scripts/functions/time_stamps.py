@@ -0,0 +1,37 @@
+'''
+Contains a function for labeling video frames with their time
+'''
+
+from __future__ import division
+
+import numpy as np
+
+
+
+def get_time_stamps(frame_ids, fps):
+    """ returns the time stamps of the frames with the given `frame_ids` in a
+    video with `fps` frames per second. The strings are identical to the
+    string representation of the respective `datetime.timedelta`, but they
+    are calculated for all frames at once """
+    frame_ids = np.asarray(frame_ids)
+    
+    # split the time into whole seconds and milliseconds
+    time_secs = np.floor_divide(frame_ids, fps).astype(np.int64)
+    time_frac = np.mod(frame_ids, fps)
+    time_msecs = (1000 * time_frac / fps).astype(np.int64)
+    
+    # split the seconds into days, hours, and minutes
+    days, time_secs = np.divmod(time_secs, 86400)
+    hours, time_secs = np.divmod(time_secs, 3600)
+    mins, secs = np.divmod(time_secs, 60)
+    
+    stamps = []
+    for d, h, m, s, ms in zip(days, hours, mins, secs, time_msecs):
+        stamp = '%d:%02d:%02d' % (h, m, s)
+        if ms:
+            stamp += '.%06d' % (1000 * ms)
+        if d:
+            stamp = '%d day%s, %s' % (d, '' if d == 1 else 's', stamp)
+        stamps.append(stamp)
+    return stamps
+
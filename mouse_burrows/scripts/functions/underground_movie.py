@@ -7,14 +7,18 @@ Created on Oct 18, 2015
 
 from __future__ import division
 
-import datetime
 import logging
+import multiprocessing as mp
+import string
 
 import numpy as np
 
 from ...simple import load_result_file
+from ...algorithm.video_output import ThreadedVideoComposer
+from .time_stamps import get_time_stamps
 from video.filters import FilterCrop
 from video.io import VideoComposer
+from video.io.parallel import VideoPreprocessor
 from video.analysis.shapes import Rectangle
 from utils.math import contiguous_true_regions
 from utils.misc import display_progress
@@ -54,8 +58,9 @@ def get_video_parts(bouts, video_length):
 
 
 def get_underground_bouts(analyzer, bouts_slice=slice(None, None),
-                          video_part=None):
-    """ load the list of bouts where the mouse is underground """
+                          video_part=None, min_duration=0):
+    """ load the list of bouts where the mouse is underground. Only bouts that
+    last at least `min_duration` frames are returned """
     # get the distance of the mouse to the ground
     mouse_ground_dists = analyzer.get_mouse_ground_distances()
 
@@ -63,7 +68,12 @@ def get_underground_bouts(analyzer, bouts_slice=slice(None, None),
     bouts = contiguous_true_regions(mouse_ground_dists < 0)
     
     # restrict to the periods that we are interested in
-    bouts = bouts[bouts_slice]
+    bouts = np.asarray(bouts, int).reshape(-1, 2)[bouts_slice]
+    
+    # discard bouts that are too short, such that they do not affect how the
+    # bouts are split into video parts
+    durations = bouts[:, 1] - bouts[:, 0] + 1
+    bouts = bouts[durations >= min_duration]
     
     # determine which bouts should be processed for this video part
     if video_part is not None:
@@ -82,7 +92,8 @@ def get_underground_bouts(analyzer, bouts_slice=slice(None, None),
 def make_underground_video(result_file, output_video=None,
                            display='{time} [{frame}]', scale_bar=True,
                            min_duration=60, blank_duration=5,
-                           bouts_slice=slice(None, None), video_part=None):
+                           bouts_slice=slice(None, None), video_part=None,
+                           use_threads=True):
     """ main routine of the program
     `result_file` is the file where the results from the video analysis are
         stored. This is usually a *.yaml file
@@ -100,14 +111,21 @@ def make_underground_video(result_file, output_video=None,
     `bouts_slice` is a slice object that determines which bouts are included in
         the video.
     `video_part` determines which part of a longer video will be produced
+    `use_threads` determines whether reading and writing the video is done in
+        separate threads, such that decoding and encoding overlap
     """
     logging.info('Analyze video `%s`', result_file)
     
+    # the durations are given in frames, but might have been passed as floats
+    min_duration = int(np.ceil(min_duration))
+    blank_duration = int(blank_duration)
+    
     # load the respective result file 
     analyzer = load_result_file(result_file)
     
     # determine the bouts of this video
-    bouts = get_underground_bouts(analyzer, bouts_slice, video_part)
+    bouts = get_underground_bouts(analyzer, bouts_slice, video_part,
+                                  min_duration)
     
     if len(bouts) == 0:
         raise RuntimeError('There are no bouts that could be turned into a '
@@ -148,14 +166,25 @@ def make_underground_video(result_file, output_video=None,
     video_codec = analyzer.params['output/video/codec']
     video_bitrate = analyzer.params['output/video/bitrate']
     fps = video_input.fps
-    video_output = VideoComposer(
+    composer = VideoComposer(
         output_video, size=video_input.size, fps=fps, is_color=False,
         codec=video_codec, bitrate=video_bitrate,
     )
+    if use_threads:
+        # encode the video in a separate thread
+        video_output = ThreadedVideoComposer(composer)
+    else:
+        video_output = composer
+    # bind the methods once, since the threaded composer creates a new
+    # function for every attribute access
+    set_frame = video_output.set_frame
+    add_rectangle = video_output.add_rectangle
+    add_text = video_output.add_text
     
-    # create blank frame with mean color of video
-    blank_frame = np.full(video_input.shape[1:], video_input[0].mean(),
-                          dtype=np.uint8)
+    # create blank frame with mean color of video, which is estimated from a
+    # subsample of the first frame
+    blank_color = video_input[0][::8, ::8].mean(dtype=np.float32)
+    blank_frame = np.full(video_input.shape[1:], blank_color, dtype=np.uint8)
     
     # time label position
     label_pos = video_input.width // 2, 30
@@ -163,63 +192,147 @@ def make_underground_video(result_file, output_video=None,
     # calculate size of scale bar and the position of its label
     pixel_size_cm = analyzer.data['pass2/pixel_size_cm']
     scale_bar_size_cm = 10
-    scale_bar_size_px = np.round(scale_bar_size_cm / pixel_size_cm)
+    scale_bar_size_px = int(round(scale_bar_size_cm / pixel_size_cm))
     scale_bar_rect = Rectangle(30, 50, scale_bar_size_px, 5)
     scale_bar_pos = (30 + scale_bar_size_px//2, 30)
+    scale_bar_label = str('%g cm' % scale_bar_size_cm)
+    
+    # determine which data needs to be calculated for the display
+    if display:
+        # format the display once, such that errors are reported before any
+        # frame has been written
+        display.format(frame=0, time='')
+        display_fields = set(field for _, field, _, _
+                             in string.Formatter().parse(display))
+    else:
+        display_fields = set()
     
     # iterate over all bouts
+    bouts_written = 0
     for start, finish in display_progress(bouts):
         
-        duration = finish - start + 1 
-        
-        # check whether bout is long enough
-        if duration < min_duration:
-            continue
-        
-        if video_output.frames_written > 1:
+        if bouts_written > 0:
             # write blank frame
             for _ in xrange(blank_duration):
-                video_output.set_frame(blank_frame)
+                set_frame(blank_frame)
                 
         video_bout = video_input[start - frame_offset : 
                                  finish - frame_offset + 1]
+        if 'time' in display_fields:
+            # calculate all time stamps of this bout at once
+            time_stamps = get_time_stamps(np.arange(start, finish + 1), fps)
+        # read the video in a separate thread
+        video_iter = VideoPreprocessor(video_bout, functions={},
+                                       use_threads=use_threads)
+        bouts_written += 1
         
-        for frame_id, frame in enumerate(video_bout, start):
-            video_output.set_frame(frame, copy=True)
+        for frame_id, data in enumerate(video_iter, start):
+            # the frame needs to be copied, since the overlays are drawn onto it
+            # and since the frames are read ahead and encoded in other threads
+            set_frame(data['raw'], copy=True)
 
             if scale_bar:
                 # show a scale bar
-                video_output.add_rectangle(scale_bar_rect, width=-1)
-                video_output.add_text(str('%g cm' % scale_bar_size_cm),
-                                      scale_bar_pos, color='w',
-                                      anchor='upper center')
+                add_rectangle(scale_bar_rect, width=-1)
+                add_text(scale_bar_label, scale_bar_pos, color='w',
+                         anchor='upper center')
 
             # gather data about this frame
             frame_data = {'frame': frame_id}
             
-            # calculate time stamp
-            time_secs, time_frac = divmod(frame_id, fps)
-            time_msecs = int(1000 * time_frac / fps)
-            dt = datetime.timedelta(seconds=time_secs,
-                                    milliseconds=time_msecs)
-            frame_data['time'] = str(dt)
+            if 'time' in display_fields:
+                frame_data['time'] = time_stamps[frame_id - start]
                 
             # output the display data
             if display:
                 display_text = display.format(**frame_data)
-                video_output.add_text(display_text, label_pos, color='w',
-                                      anchor='upper center')
+                add_text(display_text, label_pos, color='w',
+                         anchor='upper center')
+
+    # close and finalize video
+    try:
+        video_output.close()
+    except IOError:
+        logging.exception('Error while writing out the debug video `%s`',
+                          composer)
 
     # show summary
     frames_total = video_info['frames'][1] - video_info['frames'][0]
-    frames_written = video_output.frames_written
+    frames_written = composer.frames_written
     logging.info('%d (%d%%) of %d frames written', frames_written,
                  100 * frames_written // frames_total, frames_total)
+        
+
+
+
+def _get_available_cpu_count():
+    """ returns the number of cores that the current process may use. The
+    affinity mask is read from the proc file system, which is only available
+    on linux. The total number of cores is returned otherwise """
+    try:
+        with open('/proc/self/status') as fp:
+            for line in fp:
+                if line.startswith('Cpus_allowed_list:'):
+                    count = 0
+                    for part in line.split(':', 1)[1].strip().split(','):
+                        if '-' in part:
+                            first, last = part.split('-')
+                            count += int(last) - int(first) + 1
+                        else:
+                            count += 1
+                    if count > 0:
+                        return count
+    except (IOError, ValueError):
+        pass
+    return mp.cpu_count()
+
+
+
+def _make_underground_video_part(kwargs):
+    """ helper function creating a single video part in a worker process """
+    make_underground_video(**kwargs)
+
+
+
+def make_underground_video_parts(result_file, display='{time} [{frame}]',
+                                 scale_bar=True, min_duration=60,
+                                 blank_duration=5,
+                                 bouts_slice=slice(None, None),
+                                 processes=None):
+    """ creates all parts of the underground video in parallel. Each part is
+    created by `make_underground_video` in a separate process and written to
+    the file that this function determines automatically for the part.
+    `processes` is the number of worker processes. All cores available to the
+        current process are used if it is None.
+    The remaining arguments are passed to `make_underground_video`.
+    """
+    # the duration is compared to the number of frames
+    min_duration = int(np.ceil(min_duration))
+
+    # determine the number of video parts
+    analyzer = load_result_file(result_file)
+    bouts = get_underground_bouts(analyzer, bouts_slice,
+                                  min_duration=min_duration)
+    video_length = analyzer.params['output/video/underground_video_length']
+    num_parts = len(get_video_parts(bouts, video_length))
+    logging.info('Create %d video parts', num_parts)
     
-    # close and finalize video
+    jobs = [{'result_file': result_file, 'display': display,
+             'scale_bar': scale_bar, 'min_duration': min_duration,
+             'blank_duration': blank_duration, 'bouts_slice': bouts_slice,
+             'video_part': video_part}
+            for video_part in xrange(num_parts)]
+    
+    if processes is None:
+        # respect the cores that the current process may use
+        processes = _get_available_cpu_count()
+    processes = max(1, min(processes, num_parts))
+    
+    # encode the video parts in parallel
+    pool = mp.Pool(processes)
     try:
-        video_output.close()
-    except IOError:
-        logging.exception('Error while writing out the debug video `%s`',
-                          video_output)
-        
\ No newline at end of file
+        pool.map(_make_underground_video_part, jobs, chunksize=1)
+    finally:
+        pool.close()
+        pool.join()
+
@@ -12,12 +12,14 @@ import sys
 import os
 
 # add the root of the video-analysis project to the path
-script_path = os.path.split(os.path.realpath(__file__))[0]
-package_path = os.path.abspath(os.path.join(script_path, '..', '..'))
-sys.path.append(package_path)
-
-video_analysis_path_guess = os.path.join(package_path, '..', 'video-analysis')
-sys.path.append(os.path.abspath(video_analysis_path_guess))
+script_path = os.path.dirname(os.path.realpath(__file__))
+package_path = os.path.dirname(os.path.dirname(script_path))
+video_analysis_path = os.path.join(os.path.dirname(package_path),
+                                   'video-analysis')
+for path in (package_path, video_analysis_path):
+    # avoid duplicate entries if the module is imported repeatedly
+    if path not in sys.path:
+        sys.path.append(path)
 
 from mouse_burrows.scripts.functions.cropped_movie import make_cropped_video
 
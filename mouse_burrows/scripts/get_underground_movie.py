@@ -12,15 +12,14 @@ import sys
 import os
 
 # add the root of the video-analysis project to the path
-script_path = os.path.split(os.path.realpath(__file__))[0]
-package_path = os.path.abspath(os.path.join(script_path, '..', '..'))
-sys.path.append(package_path)
-
-video_analysis_path_guess = os.path.join(package_path, '..', 'video-analysis')
-sys.path.append(os.path.abspath(video_analysis_path_guess))
-
-from mouse_burrows.scripts.functions.underground_movie import \
-                                                        make_underground_video
+script_path = os.path.dirname(os.path.realpath(__file__))
+package_path = os.path.dirname(os.path.dirname(script_path))
+video_analysis_path = os.path.join(os.path.dirname(package_path),
+                                   'video-analysis')
+for path in (package_path, video_analysis_path):
+    # avoid duplicate entries if the module is imported repeatedly
+    if path not in sys.path:
+        sys.path.append(path)
 
 
 
@@ -55,24 +54,48 @@ def main():
                        help='the range of bouts to include in the analysis')
     group.add_argument('--video_part', type=int, metavar='NR',
                        help='part of the full video that is created')
+    parser.add_argument('--all_parts', action='store_true', default=False,
+                        help='creates all parts of the video in parallel')
+    parser.add_argument('-p', '--processes', type=int, default=None,
+                        help='number of processes used for creating all parts')
     
     # fetch the arguments and build the parameter list
     args = parser.parse_args()
     
+    # import the analysis code only after the arguments have been checked,
+    # which keeps the start-up of the script fast
+    from mouse_burrows.scripts.functions.underground_movie import \
+                        make_underground_video, make_underground_video_parts
+    
     # prepare the bout slice argument
     if args.bout_slice:
         bout_slice = slice(*args.bout_slice)
     else:
         bout_slice = slice(None, None)
     
-    # create the video
-    make_underground_video(result_file=args.result_file,
-                           output_video=args.output_file,
-                           display=args.display, scale_bar=args.scale_bar,
-                           min_duration=args.min_duration,
-                           blank_duration=args.blank_duration,
-                           bouts_slice=bout_slice,
-                           video_part=args.video_part)
+    if args.all_parts:
+        if args.output_file or args.video_part is not None:
+            parser.error('The names of the video parts are determined '
+                         'automatically if all parts are created')
+            
+        # create all video parts in parallel
+        make_underground_video_parts(result_file=args.result_file,
+                                     display=args.display,
+                                     scale_bar=args.scale_bar,
+                                     min_duration=args.min_duration,
+                                     blank_duration=args.blank_duration,
+                                     bouts_slice=bout_slice,
+                                     processes=args.processes)
+        
+    else:
+        # create the video
+        make_underground_video(result_file=args.result_file,
+                               output_video=args.output_file,
+                               display=args.display, scale_bar=args.scale_bar,
+                               min_duration=args.min_duration,
+                               blank_duration=args.blank_duration,
+                               bouts_slice=bout_slice,
+                               video_part=args.video_part)
     
 
 
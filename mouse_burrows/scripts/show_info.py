@@ -8,18 +8,74 @@ Created on Sep 21, 2016
 from __future__ import division
 
 import argparse
+import collections
+import json
 import sys
 import os
 
+import numpy as np
+
 # add the root of the video-analysis project to the path
-script_path = os.path.split(os.path.realpath(__file__))[0]
-package_path = os.path.abspath(os.path.join(script_path, '..', '..'))
-sys.path.append(package_path)
+script_path = os.path.dirname(os.path.realpath(__file__))
+package_path = os.path.dirname(os.path.dirname(script_path))
+video_analysis_path = os.path.join(os.path.dirname(package_path),
+                                   'video-analysis')
+for path in (package_path, video_analysis_path):
+    # avoid duplicate entries if the module is imported repeatedly
+    if path not in sys.path:
+        sys.path.append(path)
+
+
+# cache of the analyzers of recently loaded result files. Each analyzer holds
+# all data of its result file, so only a few of them are kept by default.
+_analyzer_cache = collections.OrderedDict()
+analyzer_cache_size = 8
+
+
+
+def _load_result_file_cached(result_file):
+    """ loads the result file and caches the analyzer. The cached analyzer is
+    only used if the file did not change since it was loaded """
+    # import the analysis code only when it is needed, which keeps the
+    # start-up of the script fast, e.g., when only the help is shown
+    from mouse_burrows.simple import load_result_file
+    
+    key = os.path.realpath(result_file)
+    stat = os.stat(key)
+    signature = (stat.st_mtime, stat.st_size)
+    
+    try:
+        cached_signature, analyzer = _analyzer_cache.pop(key)
+    except KeyError:
+        cached_signature = None
+        
+    if cached_signature != signature:
+        analyzer = load_result_file(result_file, use_cache=True)
+        
+    # store the analyzer as the most recently used item
+    _analyzer_cache[key] = (signature, analyzer)
+    while len(_analyzer_cache) > max(analyzer_cache_size, 0):
+        _analyzer_cache.popitem(last=False)
+        
+    return analyzer
 
-video_analysis_path_guess = os.path.join(package_path, '..', 'video-analysis')
-sys.path.append(os.path.abspath(video_analysis_path_guess))
 
-from mouse_burrows.simple import load_result_file
+
+def _json_default(obj):
+    """ converts objects that cannot be serialized by json directly. Mappings,
+    like the nested dictionary of parameters, are converted level by level
+    while they are encoded, which avoids creating a deep copy beforehand.
+    Objects that have no json representation are returned as their `repr` """
+    if isinstance(obj, collections.Mapping):
+        return dict(obj)
+    elif isinstance(obj, np.ndarray):
+        return obj.tolist()
+    elif isinstance(obj, np.generic):
+        return obj.item()
+    elif isinstance(obj, (set, frozenset)):
+        return list(obj)
+    else:
+        return repr(obj)
 
 
 
@@ -31,13 +87,12 @@ def get_info(result_file, parameters=False):
     `parameters` is a flag that indicates whether the parameters of the result
         file are shown
     """
-    # load the respective result file 
-    analyzer = load_result_file(result_file)
-
     info = {}
 
     if parameters:
-        info['Parameters'] = analyzer.params.to_dict()
+        # load the respective result file only if data is requested
+        analyzer = _load_result_file_cached(result_file)
+        info['Parameters'] = analyzer.params
         
     return info
     
@@ -53,7 +108,10 @@ def main():
     )
     parser.add_argument('-r', '--result_file', metavar='FILE',
                         type=str, required=True,
-                        help='filename of video analysis result')
+                        help='filename of video analysis result. If `-` is '
+                             'given, the filenames are read line by line '
+                             'from stdin and the information about each file '
+                             'is written as a line of json to stdout')
     parser.add_argument('-p', '--parameters', action='store_true',
                         help='show all parameters')
     
@@ -61,12 +119,25 @@ def main():
     # fetch the arguments and build the parameter list
     args = parser.parse_args()
     
+    if args.result_file == '-':
+        # process many result files in a single process, such that the python
+        # interpreter and the analysis code only need to be loaded once
+        for line in iter(sys.stdin.readline, ''):
+            result_file = line.strip()
+            if not result_file:
+                continue
+            info = get_info(result_file=result_file,
+                            parameters=args.parameters)
+            sys.stdout.write(json.dumps(info, default=_json_default) + '\n')
+            sys.stdout.flush()
+        return
+    
     # obtain information from data
     info = get_info(result_file=args.result_file, parameters=args.parameters)
     
-    # TODO: add other output methods, like json, yaml, python dict
-    from pprint import pprint
-    pprint(info)
+    # TODO: add other output methods, like yaml, python dict
+    sys.stdout.write(json.dumps(info, indent=2, sort_keys=True,
+                                default=_json_default) + '\n')
     
 
 
@@ -11,11 +11,11 @@ from __future__ import division
 import os
 import warnings
 
-import yaml
 
 from .algorithm import FirstPass, SecondPass, ThirdPass, FourthPass
 from .algorithm.parameters import PARAMETERS_DEFAULT
 from .algorithm.analyzer import Analyzer
+from .algorithm.data_handler import read_yaml_file
 
 
 
@@ -84,8 +84,11 @@ def load_results(name, parameters=None, cls=Analyzer, **kwargs):
 
 
 
-def load_result_file(result_file, parameters=None, do_logging=None, **kwargs):
-    """ loads the results of a simulation based on the result file """
+def load_result_file(result_file, parameters=None, do_logging=None,
+                     use_cache=False, **kwargs):
+    """ loads the results of a simulation based on the result file. If
+    `use_cache` is True, the parsed result file is cached in a pickle file
+    next to it, which speeds up loading the same file repeatedly """
     if not result_file.endswith('_results.yaml'):
         raise ValueError('Invalid result filename.')
     
@@ -95,8 +98,7 @@ def load_result_file(result_file, parameters=None, do_logging=None, **kwargs):
     name = filename[:-len('_results.yaml')]
     
     # read the paths from the yaml file
-    with open(result_file, 'r') as infile:
-        data = yaml.load(infile)
+    data = read_yaml_file(result_file, use_cache=use_cache)
     result_folder = data['parameters']['output']['folder']   
 
     # infer base folder
@@ -125,5 +127,5 @@ def load_result_file(result_file, parameters=None, do_logging=None, **kwargs):
         parameters['logging/enabled'] = do_logging
 
     # load results
-    return load_results(name, parameters, **kwargs)
+    return load_results(name, parameters, use_yaml_cache=use_cache, **kwargs)
     
\ No newline at end of file